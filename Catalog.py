@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# Copyright 2008 Michael Toth
+"""
+Virtual Page Turner, a program to help musicians view and turn pages using a computer.
+
+    Copyright (C) 2008  Michael Toth
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+import sys
+import errno
+import time
+import threading
+import sqlite3
+from Program import ScanFiles, NaturalKey, ReadManifest, RECOGNIZED_EXTENSIONS
+from PageStrip import ReadImageSize
+from Pyramid import PYRAMID_DIR
+
+"""
+The catalog is an SQLite database (normally VPT_HOME/catalog.db) of every piece
+directory below MUSIC_DIR.  A piece directory is one that holds recognized page files.
+
+    dirs   - every directory visited: path, parent, modification time
+    pieces - path, name, file type, number of pages, number of bookmarks, last opened time
+    pages  - path of the piece, page number, file name, full width and height
+
+A refresh only lists the directories whose modification time changed since the last
+one; for the rest a stat is enough, so a large library refreshes quickly.
+Paths and file names are kept as byte strings in the file system encoding, the way
+os.listdir returns them for a byte string directory, so names that are not ASCII
+(e.g. Dvo\xc5\x99\xc3\xa1k) round trip exactly.
+A directory that can't be read for the moment (e.g. a network share that is slow to
+answer) keeps what was catalogued below it until a later refresh can read it.
+Everything about a directory is read before its rows are written, so the write lock
+is only held for the inserts; a refresh never makes MarkOpened wait on the library.
+"""
+# directories inside a piece that hold copies of its pages, not pieces
+SKIPPED_DIRS = ['original', PYRAMID_DIR]
+
+# seconds MarkOpened waits for a refresh to release the database
+MARK_TIMEOUT = 0.5
+
+SCHEMA = [
+    """create table if not exists dirs (path text primary key, parent text, mtime real)""",
+    """create table if not exists pieces (path text primary key, name text, fileType text,
+       nPages integer, nBookmarks integer, lastOpened real)""",
+    """create table if not exists pages (piece text, pageNum integer, fileName text,
+       width integer, height integer, primary key (piece, pageNum))""",
+    """create index if not exists dirsByParent on dirs (parent)""",
+]
+
+def EncodePath(path):
+    """ path as a byte string in the file system encoding """
+    if isinstance(path, unicode):
+        return path.encode(sys.getfilesystemencoding() or 'utf-8')
+    return path
+
+def CountBookmarks(dirName):
+    """ number of bookmarks saved in the Bookmarks.txt of a piece """
+    fname = dirName + '/Bookmarks.txt'
+    if not os.path.exists(fname):
+        return 0
+    try:
+        f = open(fname,'r')
+        line = f.readline()
+        f.close()
+        return int(line.strip('\n'))
+    except (IOError,ValueError):
+        return 0
+
+class Catalog:
+    """
+    Catalog of the pieces in the music library.
+    Methods are:
+       Refresh(musicDir) - brings the catalog up to date with the library (slow the first time)
+       RefreshInBackground(musicDir) - the same on a background thread
+       MarkOpened(piece) - records that piece was just opened, adding it if it is not catalogued
+       GetPieces() - (path,name,fileType,nPages,nBookmarks,lastOpened) of every piece, by name
+                     (paths and names are byte strings, see EncodePath)
+       GetVersion() - a number that changes whenever pieces are added or removed
+       GetPages(path) - (pageNum,fileName,width,height) of every page of a piece
+    Each call uses its own connection, so the methods can be called from any thread.
+    skippedDirs are directories never walked, such as the rendition cache and the
+    images of VPT_HOME, which may be inside the music library.
+    MarkOpened is called from the user interface, so it gives up rather than wait
+    more than MARK_TIMEOUT seconds for the database.
+    """
+    def __init__(self, fileName, skippedDirs=[]):
+        self.fileName = fileName
+        self.skippedDirs = set([os.path.abspath(EncodePath(d)) for d in skippedDirs])
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.version = 0
+        conn = self.Connect()
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        conn.close()
+
+    def Connect(self, timeout=30):
+        conn = sqlite3.connect(self.fileName, timeout=timeout)
+        # paths are byte strings (see EncodePath), so store and return them as such
+        conn.text_factory = str
+        return conn
+
+    def RefreshInBackground(self, musicDir):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        t = threading.Thread(target=self.Refresh,args=(musicDir,))
+        t.setDaemon(True)
+        t.start()
+
+    def Refresh(self, musicDir):
+        """ returns the number of directories that had to be listed """
+        try:
+            return self.Walk(musicDir)
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def Walk(self, musicDir):
+        conn = self.Connect()
+        known = {}
+        children = {}
+        for (path, parent, mtime) in conn.execute('select path, parent, mtime from dirs'):
+            known[path] = mtime
+            children.setdefault(parent,[]).append(path)
+        seen = set()
+        listed = 0
+        stack = [EncodePath(musicDir)]
+        while stack:
+            dirName = stack.pop()
+            if os.path.abspath(dirName) in self.skippedDirs:
+                continue
+            seen.add(dirName)
+            try:
+                mtime = os.path.getmtime(dirName)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    self.KeepSubtree(seen, children, dirName)
+                continue
+            if known.get(dirName) == mtime:
+                stack.extend(children.get(dirName,[]))
+                continue
+            listed = listed + 1
+            subdirs = []
+            try:
+                for name in os.listdir(dirName):
+                    path = os.path.join(dirName,name)
+                    if name not in SKIPPED_DIRS and os.path.isdir(path):
+                        subdirs.append(path)
+                piece = self.ScanPiece(dirName)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    self.KeepSubtree(seen, children, dirName)
+                continue
+            conn.execute('insert or replace into dirs values (?,?,?)',
+                         (dirName, os.path.dirname(dirName), mtime))
+            if piece == None:
+                self.RemovePiece(conn, dirName)
+            else:
+                (fileType, pages, nBookmarks) = piece
+                self.StorePiece(conn, dirName, fileType, pages, nBookmarks)
+            conn.commit()
+            stack.extend(subdirs)
+        for path in known:
+            if path not in seen:
+                conn.execute('delete from dirs where path = ?', (path,))
+                self.RemovePiece(conn, path)
+        conn.commit()
+        conn.close()
+        if listed or len(seen) != len(known):
+            self.version = self.version + 1
+        return listed
+
+    def KeepSubtree(self, seen, children, dirName):
+        """ marks everything catalogued below dirName as seen, so a refresh that can't read it keeps it """
+        stack = [dirName]
+        while stack:
+            path = stack.pop()
+            seen.add(path)
+            stack.extend(children.get(path,[]))
+
+    def GetVersion(self):
+        return self.version
+
+    def ScanPiece(self, dirName):
+        """
+        returns (fileType, [(fileName,size),...], nBookmarks) of dirName, using its manifest
+        when that is up to date, or None if it holds no pages.  Only reads the disk.
+        """
+        manifest = ReadManifest(dirName)
+        if manifest != None and manifest[0] == os.path.getmtime(dirName):
+            fileType = manifest[1]
+            pages = [(fileName, size) for (fileName, size, mtime) in manifest[2]]
+        else:
+            filesBySuffix = ScanFiles(dirName, RECOGNIZED_EXTENSIONS)
+            if not filesBySuffix:
+                return None
+            if manifest != None and manifest[1] in filesBySuffix:
+                fileType = manifest[1]
+            else:
+                # without asking, the file type with the most pages is the one shown
+                fileType = max(filesBySuffix.keys(), key=lambda suffix: len(filesBySuffix[suffix]))
+            names = [fileName for (fileName, stat) in filesBySuffix[fileType]]
+            names.sort(key=NaturalKey)
+            pages = [(fileName, ReadImageSize(os.path.join(dirName,fileName))) for fileName in names]
+        return (fileType, pages, CountBookmarks(dirName))
+
+    def StorePiece(self, conn, dirName, fileType, pages, nBookmarks):
+        row = conn.execute('select lastOpened from pieces where path = ?', (dirName,)).fetchone()
+        lastOpened = None
+        if row != None:
+            lastOpened = row[0]
+        conn.execute('insert or replace into pieces values (?,?,?,?,?,?)',
+                     (dirName, os.path.basename(dirName), fileType, len(pages), nBookmarks, lastOpened))
+        conn.execute('delete from pages where piece = ?', (dirName,))
+        pageNum = 1
+        for (fileName, size) in pages:
+            (width, height) = size or (0, 0)
+            conn.execute('insert into pages values (?,?,?,?,?)', (dirName, pageNum, fileName, width, height))
+            pageNum = pageNum + 1
+
+    def RemovePiece(self, conn, dirName):
+        conn.execute('delete from pieces where path = ?', (dirName,))
+        conn.execute('delete from pages where piece = ?', (dirName,))
+
+    def MarkOpened(self, piece):
+        if piece == None or piece.GetName() == None:
+            return
+        conn = self.Connect(MARK_TIMEOUT)
+        dirName = EncodePath(piece.GetName())
+        try:
+            added = False
+            if conn.execute('select path from pieces where path = ?', (dirName,)).fetchone() == None:
+                fileType = ''
+                if piece.pages:
+                    fileType = os.path.splitext(piece.pages[0].GetPageFileName())[1]
+                self.StorePiece(conn, dirName, EncodePath(fileType),
+                                [(EncodePath(page.GetPageFileName()), page.GetSize()) for page in piece.pages], 0)
+                added = True
+            conn.execute('update pieces set lastOpened = ?, nBookmarks = ? where path = ?',
+                         (time.time(), len(piece.bookMarks), dirName))
+            conn.commit()
+            if added:
+                self.version = self.version + 1
+        except sqlite3.OperationalError:
+            # the database is busy; the next refresh catalogues the piece anyway
+            conn.rollback()
+        conn.close()
+
+    def GetPieces(self):
+        conn = self.Connect()
+        rows = conn.execute('select path, name, fileType, nPages, nBookmarks, lastOpened '
+                            'from pieces order by name').fetchall()
+        conn.close()
+        return rows
+
+    def GetPages(self, path):
+        conn = self.Connect()
+        rows = conn.execute('select pageNum, fileName, width, height from pages '
+                            'where piece = ? order by pageNum', (EncodePath(path),)).fetchall()
+        conn.close()
+        return rows
+
+if __name__ == '__main__':
+    # check that a piece whose directory name is not ASCII is catalogued along with the rest
+    import tempfile
+    import shutil
+    library = tempfile.mkdtemp()
+    try:
+        expected = [os.path.join(library, EncodePath(piece)) for piece in [u'Bach/Partita', u'Dvo\u0159\xe1k/Sonata']]
+        for path in expected:
+            os.makedirs(path)
+            f = open(os.path.join(path, 'Page1.gif'), 'wb')
+            f.write('GIF89a\x01\x00\x01\x00')
+            f.close()
+        catalog = Catalog(os.path.join(library, 'catalog.db'))
+        catalog.Refresh(unicode(library))
+        paths = [path for (path, name, fileType, nPages, nBookmarks, lastOpened) in catalog.GetPieces()]
+        assert paths == expected, paths
+        assert catalog.GetPages(expected[1]) == [(1, 'Page1.gif', 1, 1)]
+        print 'catalog ok'
+    finally:
+        shutil.rmtree(library)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Copyright 2008 Michael Toth
+"""
+Virtual Page Turner, a program to help musicians view and turn pages using a computer.
+
+    Copyright (C) 2008  Michael Toth
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import time
+
+try:
+    Now = time.monotonic
+except AttributeError:
+    # no monotonic clock before Python 3.3; Tick clamps any jump of the wall clock
+    Now = time.time
+
+FRAME_INTERVAL = 16 # milliseconds, about one frame at 60Hz
+
+class FrameClock:
+    """
+    Measures the time between frames of the smooth auto-scroll.
+    A frame is counted as dropped when it arrives more than 1.5 frame intervals
+    after the one before it.
+    Methods are:
+       Start() - starts timing from now and clears the statistics
+       Tick() - returns the seconds since the last frame
+       GetStatistics() - a string for the status bar
+    """
+    def __init__(self, interval=FRAME_INTERVAL):
+        self.interval = interval/1000.0
+        self.Start()
+
+    def Start(self):
+        self.last = Now()
+        self.frames = 0
+        self.dropped = 0
+        self.worst = 0.0
+
+    def Tick(self):
+        now = Now()
+        elapsed = now - self.last
+        self.last = now
+        # a clock that went backwards or a stall (e.g. a modal dialog) must not make the view jump
+        elapsed = max(0.0, min(elapsed, 0.25))
+        self.frames = self.frames + 1
+        if elapsed > 1.5*self.interval:
+            self.dropped = self.dropped + 1
+        self.worst = max(self.worst, elapsed)
+        return elapsed
+
+    def GetStatistics(self):
+        return 'scroll: %d frames, %d dropped, worst %dms' % (self.frames, self.dropped, int(self.worst*1000))
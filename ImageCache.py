@@ -0,0 +1,513 @@
+#!/usr/bin/env python
+# Copyright 2008 Michael Toth
+"""
+Virtual Page Turner, a program to help musicians view and turn pages using a computer.
+
+    Copyright (C) 2008  Michael Toth
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import wx
+import os
+import threading
+import Queue
+import hashlib
+from collections import OrderedDict
+
+"""
+PIL is optional.  When it is installed JPEG pages can be decoded at 1/2, 1/4 or 1/8
+of their size during the DCT, so decode time and memory follow the screen size
+rather than the scan resolution.  Without it every page is decoded by wx at full size.
+"""
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+JPEG_EXTENSIONS = ['jpg','jpeg','JPG','JPEG']
+JPEG_REDUCTIONS = [2,4,8]
+
+def ChooseReduction(fileName, size, targetX, targetY):
+    """
+    Returns the largest DCT reduction (2, 4 or 8) at which the JPEG page fileName of
+    full size 'size' still covers targetX by targetY, or 1 for a full size decode.
+    """
+    if PILImage == None or size == None or fileName.split('.')[-1] not in JPEG_EXTENSIONS:
+        return 1
+    choice = 1
+    for reduction in JPEG_REDUCTIONS:
+        if size[0]/reduction >= targetX and size[1]/reduction >= targetY:
+            choice = reduction
+        else:
+            break
+    return choice
+
+def DecodeKey(fileName, reduction=1):
+    """ the key of a decoded image: the file name, or (file name, reduction) for a reduced JPEG decode """
+    if reduction == 1:
+        return fileName
+    return (fileName, reduction)
+
+def KeyPath(key):
+    """ the file name of a decode key """
+    if isinstance(key, tuple):
+        return key[0]
+    return key
+
+def DecodeReducedJPEG(fileName, reduction):
+    """
+    decodes a JPEG with PIL at 1/reduction of its size.  Raises whatever PIL raises for a
+    file it can't read (IOError, SyntaxError, ValueError, ... depending on the version).
+    """
+    im = PILImage.open(fileName)
+    im.draft('RGB', (im.size[0]/reduction, im.size[1]/reduction))
+    im = im.convert('RGB')
+    image = wx.EmptyImage(im.size[0], im.size[1])
+    if hasattr(im, 'tobytes'):
+        image.SetData(im.tobytes())
+    else:
+        image.SetData(im.tostring())
+    return image
+
+def DecodeImage(key):
+    """
+    decodes the image for a decode key, reducing JPEGs during the DCT when the key asks for it.
+    A JPEG PIL can't read is left to wx, which decodes it at full size if it can.
+    """
+    if isinstance(key, tuple) and PILImage != None:
+        try:
+            return DecodeReducedJPEG(key[0], key[1])
+        except Exception:
+            pass
+    return wx.Image(KeyPath(key))
+
+IMAGE = 'image'
+BITMAP = 'bitmap'
+OVERLAY = 'overlay'
+
+class PageImageStore:
+    """
+    Central owner of the page images held in memory: decoded wx.Image data
+    (keyed by file name) and scaled, ready to blit wx.Bitmaps (keyed by
+    file name, modification time, view mode and client size), as well as the
+    pre-rendered annotation overlays drawn over the pages.
+    Decoded images may also be keyed by (file name, reduction) for reduced JPEG decodes.
+    Both share one memory budget and are evicted least recently used first,
+    but their bytes are accounted separately so the occupancy can be shown.
+    The bitmaps on screen are pinned and never evicted.
+    Images may be stored from worker threads; bitmaps and overlays are only created,
+    used and released on the main thread.
+    Methods are:
+       GetImage(fileName) - returns a copy of the decoded image, decoding it on a miss
+       PutImage(fileName,image) - stores a decoded image
+       ContainsImage(fileName) - True if the image is already decoded
+       InvalidateImage(fileName) - forgets a decoded image
+       MakeBitmapKey(fileName,viewMode,sizeX,sizeY,mtime) - the key of a scaled bitmap
+       GetBitmap(key), PutBitmap(key,bitmap) - scaled bitmap lookup and store
+       PeekBitmap(key) - the scaled bitmap if it is stored, without counting a hit or miss
+       GetOverlay(key), PutOverlay(key,overlay) - annotation overlay lookup and store
+       InvalidateFile(fileName) - forgets the image, every scaled bitmap and the overlays of a page
+       Pin(keys) - protects the bitmaps for keys from eviction
+       SetBudget(nBytes) - changes the memory budget
+       GetOccupancy() - dictionary of entry counts and bytes of each kind
+    """
+    def __init__(self, budget=128*1024*1024):
+        self.budget = budget
+        self.lock = threading.RLock()
+        self.tick = 0
+        self.entries = {IMAGE: OrderedDict(), BITMAP: OrderedDict(), OVERLAY: OrderedDict()}
+        self.nBytes = {IMAGE: 0, BITMAP: 0, OVERLAY: 0}
+        self.hits = {IMAGE: 0, BITMAP: 0, OVERLAY: 0}
+        self.misses = {IMAGE: 0, BITMAP: 0, OVERLAY: 0}
+        self.pinned = set()
+
+    def Lookup(self, kind, key):
+        with self.lock:
+            entry = self.entries[kind].pop(key, None)
+            if entry == None:
+                self.misses[kind] = self.misses[kind] + 1
+                return None
+            self.tick = self.tick + 1
+            self.entries[kind][key] = (entry[0], entry[1], self.tick)
+            self.hits[kind] = self.hits[kind] + 1
+            return entry[0]
+
+    def Store(self, kind, key, item, nBytes):
+        with self.lock:
+            self.Discard(kind, key)
+            self.tick = self.tick + 1
+            self.entries[kind][key] = (item, nBytes, self.tick)
+            self.nBytes[kind] = self.nBytes[kind] + nBytes
+            self.Enforce()
+
+    def Discard(self, kind, key):
+        with self.lock:
+            entry = self.entries[kind].pop(key, None)
+            if entry != None:
+                self.nBytes[kind] = self.nBytes[kind] - entry[1]
+
+    def Enforce(self):
+        """
+        evicts the least recently used image, bitmap or overlay until the store is within budget.
+        Bitmaps and overlays are only released on the main thread.
+        """
+        if wx.Thread_IsMain():
+            kinds = (IMAGE, BITMAP, OVERLAY)
+        else:
+            kinds = (IMAGE,)
+        with self.lock:
+            while self.nBytes[IMAGE] + self.nBytes[BITMAP] + self.nBytes[OVERLAY] > self.budget:
+                victim = None
+                for kind in kinds:
+                    for key, (item, nBytes, tick) in self.entries[kind].iteritems():
+                        if (kind, key) in self.pinned:
+                            continue
+                        if victim == None or tick < victim[2]:
+                            victim = (kind, key, tick)
+                        break
+                if victim == None:
+                    return
+                self.Discard(victim[0], victim[1])
+
+    def GetImage(self, fileName):
+        """
+        Returns a copy of the decoded image for fileName.
+        A copy is returned because the caller rescales it in place.
+        """
+        image = self.Lookup(IMAGE, fileName)
+        if image == None:
+            image = DecodeImage(fileName)
+            self.PutImage(fileName, image)
+        return image.Copy()
+
+    def PutImage(self, fileName, image):
+        nBytes = image.GetWidth() * image.GetHeight() * 3
+        if image.HasAlpha():
+            nBytes = nBytes + image.GetWidth() * image.GetHeight()
+        self.Store(IMAGE, fileName, image, nBytes)
+
+    def PeekImage(self, fileName):
+        """ Returns the stored image for fileName (not a copy) without counting a hit or miss """
+        with self.lock:
+            entry = self.entries[IMAGE].get(fileName)
+        if entry == None:
+            return None
+        return entry[0]
+
+    def ContainsImage(self, fileName):
+        with self.lock:
+            return fileName in self.entries[IMAGE]
+
+    def InvalidateImage(self, fileName):
+        self.Discard(IMAGE, fileName)
+
+    def MakeBitmapKey(self, fileName, viewMode, sizeX, sizeY, mtime=None):
+        """ mtime is the modification time of fileName if the caller knows it; otherwise the file is stat'ed """
+        if mtime == None:
+            try:
+                mtime = os.path.getmtime(fileName)
+            except OSError:
+                mtime = None
+        return (fileName, mtime, viewMode, sizeX, sizeY)
+
+    def GetBitmap(self, key):
+        return self.Lookup(BITMAP, key)
+
+    def PeekBitmap(self, key):
+        """ Returns the bitmap for key without counting a hit or miss or making it recently used """
+        with self.lock:
+            entry = self.entries[BITMAP].get(key)
+        if entry == None:
+            return None
+        return entry[0]
+
+    def PutBitmap(self, key, bitmap):
+        self.Store(BITMAP, key, bitmap, bitmap.GetWidth() * bitmap.GetHeight() * 4)
+
+    def GetOverlay(self, key):
+        return self.Lookup(OVERLAY, key)
+
+    def PutOverlay(self, key, overlay):
+        """ overlay is (bitmap, x, y) """
+        bitmap = overlay[0]
+        self.Store(OVERLAY, key, overlay, bitmap.GetWidth() * bitmap.GetHeight() * 4)
+
+    def InvalidateFile(self, fileName):
+        """ drops the decoded images, every scaled bitmap and the annotation overlays of fileName """
+        with self.lock:
+            for key in self.entries[IMAGE].keys():
+                if KeyPath(key) == fileName:
+                    self.Discard(IMAGE, key)
+            for key in self.entries[BITMAP].keys():
+                if key[0] == fileName:
+                    self.Discard(BITMAP, key)
+            for key in self.entries[OVERLAY].keys():
+                if key[0] == fileName:
+                    self.Discard(OVERLAY, key)
+
+    def Pin(self, keys):
+        """ protects the bitmaps for keys (the pages on screen) from eviction, unpinning the rest """
+        with self.lock:
+            self.pinned = set([(BITMAP, key) for key in keys])
+            self.Enforce()
+
+    def SetBudget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.Enforce()
+
+    def Clear(self):
+        with self.lock:
+            for kind in (IMAGE, BITMAP, OVERLAY):
+                self.entries[kind].clear()
+                self.nBytes[kind] = 0
+
+    def GetOccupancy(self):
+        """ Returns the number of entries and bytes held for each kind, and the budget """
+        with self.lock:
+            return {'images': len(self.entries[IMAGE]),
+                    'imageBytes': self.nBytes[IMAGE],
+                    'bitmaps': len(self.entries[BITMAP]),
+                    'bitmapBytes': self.nBytes[BITMAP],
+                    'overlays': len(self.entries[OVERLAY]),
+                    'overlayBytes': self.nBytes[OVERLAY],
+                    'budget': self.budget}
+
+    def GetStatistics(self):
+        """ Returns a short string with the occupancy and hit counts for the status bar """
+        occupancy = self.GetOccupancy()
+        return ''.join(['Images: ', str(occupancy['images']), ' (', str(occupancy['imageBytes']/1024), ' KB, ',
+                        str(self.hits[IMAGE]), ' hits, ', str(self.misses[IMAGE]), ' misses)  ',
+                        'Bitmaps: ', str(occupancy['bitmaps']), ' (', str(occupancy['bitmapBytes']/1024), ' KB, ',
+                        str(self.hits[BITMAP]), ' hits, ', str(self.misses[BITMAP]), ' misses)  ',
+                        'Overlays: ', str(occupancy['overlays']), ' (', str(occupancy['overlayBytes']/1024), ' KB)  ',
+                        'Budget: ', str(occupancy['budget']/1024), ' KB'])
+
+
+"""
+Decode priorities, lowest first.  Pages further ahead than the next one get
+PRIORITY_AHEAD plus their distance from the current page.
+"""
+PRIORITY_VISIBLE = 0
+PRIORITY_NEXT = 1
+PRIORITY_PREVIOUS = 2
+PRIORITY_BOOKMARK = 3
+PRIORITY_NEXT_PIECE = 4
+PRIORITY_AHEAD = 5
+
+class DecodeScheduler:
+    """
+    Decodes page images on worker threads into a PageImageStore, most urgent first.
+    Schedule() replaces all outstanding work: files that are no longer wanted
+    (e.g. after a jump to a bookmark or another piece) are cancelled instead of
+    decoded, so a deep prefetch never delays the pages near the new position.
+    depth is the number of pages to look ahead of the current page.
+    """
+    def __init__(self, store, depth=3, nThreads=2):
+        self.store = store
+        self.depth = depth
+        self.queue = Queue.PriorityQueue()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.sequence = 0
+        self.active = set()
+        self.decoded = 0
+        self.cancelled = 0
+        self.threads = []
+        for i in range(0,nThreads):
+            t = threading.Thread(target=self.Run)
+            t.setDaemon(True)
+            t.start()
+            self.threads.append(t)
+
+    def SetDepth(self, depth):
+        self.depth = depth
+
+    def Schedule(self, requests):
+        """
+        requests is a list of (priority, fileName) or (priority, fileName, callback).
+        Everything queued by an earlier call is cancelled; a file requested twice
+        keeps its lowest priority.  A callback is called on the worker thread
+        with (fileName, image) once the image is decoded (or found in the store).
+        """
+        wanted = {}
+        callbacks = {}
+        for request in requests:
+            (priority, fileName) = request[0:2]
+            if fileName not in wanted or priority < wanted[fileName]:
+                wanted[fileName] = priority
+            if len(request) > 2:
+                callbacks.setdefault(fileName, []).append(request[2])
+        with self.lock:
+            self.generation = self.generation + 1
+            for (fileName, priority) in wanted.items():
+                fileCallbacks = callbacks.get(fileName, [])
+                if not fileCallbacks and (self.store.ContainsImage(fileName) or fileName in self.active):
+                    continue
+                self.sequence = self.sequence + 1
+                self.queue.put((priority, self.sequence, self.generation, fileName, fileCallbacks))
+
+    def Cancel(self):
+        """ cancels all queued work """
+        self.Schedule([])
+
+    def Run(self):
+        while True:
+            (priority, sequence, generation, fileName, callbacks) = self.queue.get()
+            with self.lock:
+                if generation != self.generation:
+                    self.cancelled = self.cancelled + 1
+                    continue
+                if fileName in self.active and not callbacks:
+                    continue
+                self.active.add(fileName)
+            try:
+                image = self.store.PeekImage(fileName)
+                if image == None and os.path.exists(KeyPath(fileName)):
+                    image = DecodeImage(fileName)
+                    if image.Ok():
+                        self.store.PutImage(fileName, image)
+                        self.decoded = self.decoded + 1
+                    else:
+                        image = None
+                if image != None:
+                    for callback in callbacks:
+                        callback(fileName, image)
+            except:
+                pass
+            with self.lock:
+                self.active.discard(fileName)
+
+    def GetStatistics(self):
+        return ''.join(['Decodes: ', str(self.decoded), ' done, ', str(self.cancelled), ' cancelled'])
+
+
+class RenditionCache:
+    """
+    Display ready page images kept on disk (normally under VPT_HOME/renditions),
+    so a piece opened again at the same display size skips the full size decode.
+    Entries are keyed by source path, source modification time and size and target size;
+    an edited page therefore simply misses.  The source is stat'ed on every lookup rather
+    than trusting the mtime recorded by a scan: the cache outlives the session, and a page
+    replaced in place leaves its piece's manifest looking up to date.  The stat is cheap
+    next to reading the rendition.  The least recently used files are removed once
+    the directory holds more than maxBytes.  Files are written by a background thread.
+    """
+    def __init__(self, cacheDir, maxBytes=200*1024*1024):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.nBytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.queue = Queue.Queue()
+        self.Scan()
+        t = threading.Thread(target=self.Run)
+        t.setDaemon(True)
+        t.start()
+
+    def Scan(self):
+        """ builds the LRU order from the modification times of the files already cached """
+        if not os.path.exists(self.cacheDir):
+            os.mkdir(self.cacheDir)
+        files = []
+        for name in os.listdir(self.cacheDir):
+            if name.endswith('.png'):
+                st = os.stat(self.cacheDir + os.sep + name)
+                files.append((st.st_mtime,name,st.st_size))
+        files.sort()
+        for (mtime,name,size) in files:
+            self.entries[name] = size
+            self.nBytes = self.nBytes + size
+
+    def MakeName(self, fileName, targetSize):
+        try:
+            st = os.stat(fileName)
+        except OSError:
+            return None
+        key = '|'.join([fileName,repr(st.st_mtime),str(st.st_size),str(targetSize[0]),str(targetSize[1])])
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return hashlib.md5(key).hexdigest() + '.png'
+
+    def GetImage(self, fileName, targetSize):
+        """ Returns the cached rendition of fileName at targetSize, or None """
+        name = self.MakeName(fileName, targetSize)
+        with self.lock:
+            if name == None or name not in self.entries:
+                self.misses = self.misses + 1
+                return None
+            self.entries[name] = self.entries.pop(name)
+            self.hits = self.hits + 1
+        path = self.cacheDir + os.sep + name
+        try:
+            os.utime(path, None)
+        except OSError:
+            self.Remove(name)
+            return None
+        image = wx.Image(path, wx.BITMAP_TYPE_PNG)
+        if not image.Ok():
+            self.Remove(name)
+            return None
+        return image
+
+    def Put(self, fileName, targetSize, image):
+        """ queues a scaled image to be saved; the caller must not modify image afterwards """
+        name = self.MakeName(fileName, targetSize)
+        if name != None:
+            self.queue.put((name, image))
+
+    def Remove(self, name):
+        with self.lock:
+            size = self.entries.pop(name, None)
+            if size != None:
+                self.nBytes = self.nBytes - size
+        try:
+            os.remove(self.cacheDir + os.sep + name)
+        except OSError:
+            pass
+
+    def Run(self):
+        while True:
+            (name, image) = self.queue.get()
+            path = self.cacheDir + os.sep + name
+            try:
+                # write to a temporary name so a half written file is never read
+                image.SaveFile(path + '.tmp', wx.BITMAP_TYPE_PNG)
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rename(path + '.tmp', path)
+                size = os.path.getsize(path)
+            except:
+                continue
+            evicted = []
+            with self.lock:
+                self.nBytes = self.nBytes - self.entries.pop(name, 0) + size
+                self.entries[name] = size
+                while self.nBytes > self.maxBytes and len(self.entries) > 1:
+                    (oldName, oldSize) = self.entries.popitem(last=False)
+                    self.nBytes = self.nBytes - oldSize
+                    evicted.append(oldName)
+            for oldName in evicted:
+                try:
+                    os.remove(self.cacheDir + os.sep + oldName)
+                except OSError:
+                    pass
+
+    def GetStatistics(self):
+        return ''.join(['Rendition cache: ', str(len(self.entries)), ' files, ',
+                        str(self.nBytes/1024), ' KB, ',
+                        str(self.hits), ' hits, ', str(self.misses), ' misses'])
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Copyright 2008 Michael Toth
+"""
+Virtual Page Turner, a program to help musicians view and turn pages using a computer.
+
+    Copyright (C) 2008  Michael Toth
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import re
+import sys
+from bisect import bisect_left
+
+MAX_RESULTS = 200
+
+def ToText(text):
+    """
+    text as unicode.  Piece names come from file names and program files as byte strings
+    in the file system encoding, the search text from wx as unicode; the two must not be compared.
+    """
+    if isinstance(text, unicode):
+        return text
+    return text.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
+
+class NameIndex:
+    """
+    Index of names for type-ahead search, built once and then queried on every keystroke.
+    Every word start of every name goes into a sorted list, so names with a word beginning
+    with the text are found by binary search.  Text of 3 or more characters is also looked
+    up anywhere inside the names through an index of the 3 letter sequences they contain.
+    Matching ignores case.  Names and search text may be byte strings or unicode;
+    everything is kept as unicode (see ToText).
+    Methods are:
+       Add(name,value) - adds name, Search returns value for it
+       Search(text) - the values of the names matching text, word matches first, then by name
+    """
+    def __init__(self):
+        self.names = []
+        self.values = []
+        self.starts = None
+        self.byName = None
+        self.wordStarts = []
+        self.trigrams = {}
+
+    def Add(self, name, value):
+        i = len(self.names)
+        lower = ToText(name).lower()
+        self.names.append(lower)
+        self.values.append(value)
+        for m in re.finditer(r'\w+', lower, re.UNICODE):
+            self.wordStarts.append((lower[m.start():], i))
+        for j in range(0, len(lower)-2):
+            self.trigrams.setdefault(lower[j:j+3], set()).add(i)
+        self.starts = None
+
+    def Search(self, text):
+        if self.starts == None:
+            # sorted on the first search after names were added
+            self.wordStarts.sort()
+            self.starts = [start for (start, i) in self.wordStarts]
+            self.byName = sorted(range(0, len(self.names)), key=self.names.__getitem__)
+        text = ToText(text).lower().strip()
+        if not text:
+            return [self.values[i] for i in self.byName[:MAX_RESULTS]]
+        found = []
+        seen = set()
+        k = bisect_left(self.starts, text)
+        while k < len(self.starts) and self.starts[k].startswith(text) and len(found) < MAX_RESULTS:
+            i = self.wordStarts[k][1]
+            if i not in seen:
+                seen.add(i)
+                found.append(i)
+            k = k + 1
+        found.sort(key=self.names.__getitem__)
+        if len(text) >= 3 and len(found) < MAX_RESULTS:
+            postings = [self.trigrams.get(text[j:j+3], set()) for j in range(0, len(text)-2)]
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+            inside = [i for i in candidates if i not in seen and text in self.names[i]]
+            inside.sort(key=self.names.__getitem__)
+            found.extend(inside)
+        return [self.values[i] for i in found[:MAX_RESULTS]]
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# Copyright 2008 Michael Toth
+"""
+Virtual Page Turner, a program to help musicians view and turn pages using a computer.
+
+    Copyright (C) 2008  Michael Toth
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import wx
+import struct
+from bisect import bisect_right
+
+def ReadImageSize(fileName):
+    """
+    Returns the (width,height) of an image by reading its header only,
+    or None if the format is not one we can read this way.
+    Handles GIF, PNG, BMP and JPEG.
+    """
+    try:
+        f = open(fileName,'rb')
+    except IOError:
+        return None
+    try:
+        head = f.read(26)
+        if head[0:6] in ('GIF87a','GIF89a'):
+            return struct.unpack('<HH',head[6:10])
+        if head[0:8] == '\x89PNG\r\n\x1a\n':
+            return struct.unpack('>II',head[16:24])
+        if head[0:2] == 'BM':
+            (width,height) = struct.unpack('<ii',head[18:26])
+            return (width,abs(height))
+        if head[0:2] == '\xff\xd8':
+            # walk the JPEG markers up to the start of frame
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != '\xff':
+                    return None
+                code = ord(marker[1])
+                length = struct.unpack('>H',f.read(2))[0]
+                if 0xc0 <= code <= 0xcf and code not in (0xc4,0xc8,0xcc):
+                    (height,width) = struct.unpack('>HH',f.read(5)[1:5])
+                    return (width,height)
+                f.seek(length-2,1)
+        return None
+    finally:
+        f.close()
+
+
+class PageStrip:
+    """
+    Layout of all the pages of a piece stacked top to bottom at a common width,
+    as shown in Fit Width mode.  The scaled height of every page and the offset
+    of every page top from the top of the strip are computed once, so the page at
+    any offset is found with a binary search.
+    Methods are:
+       Top(i) - offset of the top of page i
+       Height(i) - scaled height of page i
+       SetHeight(i,height) - corrects the height of page i once its bitmap is known, True if it changed
+       PageAt(offset) - index of the page covering offset
+       PagesIn(offset,height) - indexes of the pages intersecting a window
+    """
+    def __init__(self, sizes, width):
+        """ sizes is a list of the full (width,height) of each page, width the width pages are scaled to """
+        self.width = width
+        self.heights = []
+        for (w,h) in sizes:
+            self.heights.append(int(float(width)/float(w)*h))
+        self.Layout()
+
+    def Layout(self):
+        self.tops = [0]
+        for h in self.heights:
+            self.tops.append(self.tops[-1]+h)
+
+    def NumberOfPages(self):
+        return len(self.heights)
+
+    def Top(self, i):
+        return self.tops[i]
+
+    def Height(self, i):
+        return self.heights[i]
+
+    def TotalHeight(self):
+        return self.tops[-1]
+
+    def SetHeight(self, i, height):
+        if self.heights[i] != height:
+            self.heights[i] = height
+            self.Layout()
+            return True
+        return False
+
+    def PageAt(self, offset):
+        """ Returns the index of the page covering offset, clamped to the first and last page """
+        i = bisect_right(self.tops, offset) - 1
+        return max(0, min(i, len(self.heights)-1))
+
+    def PagesIn(self, offset, height):
+        """ Returns the indexes of the pages that intersect [offset, offset+height) """
+        first = self.PageAt(offset)
+        last = self.PageAt(offset+height-1)
+        return range(first, last+1)
@@ -22,7 +22,97 @@ Virtual Page Turner, a program to help musicians view and turn pages using a com
 import wx
 import os
 import re
+import threading
+import itertools
+from multiprocessing.pool import ThreadPool
 from panels import *
+from PageStrip import ReadImageSize
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# enhance mode writes the enhanced page here, inside the piece directory, until it is saved
+ENHANCE_SCRATCH = 'temp.gif'
+
+def ScanFiles(dirName, suffixes):
+    """
+    Lists dirName once and sorts its files by suffix.
+    Returns a dictionary of suffix -> list of (fileName, statFunction) in directory order,
+    for the suffixes that occur.  A file belongs to a suffix only if its name ends with it
+    (so page.gif.bak is not a page) and there is something before it.
+    statFunction returns the os.stat of the file; with scandir it is usually already known.
+    The scratch file of enhance mode (ENHANCE_SCRATCH) is never a page.
+    """
+    found = {}
+    if scandir != None:
+        for entry in scandir(dirName):
+            suffix = os.path.splitext(entry.name)[1]
+            if suffix in suffixes and entry.name != ENHANCE_SCRATCH and entry.is_file():
+                found.setdefault(suffix,[]).append((entry.name,entry.stat))
+    else:
+        for fileName in os.listdir(dirName):
+            suffix = os.path.splitext(fileName)[1]
+            if suffix in suffixes and fileName != ENHANCE_SCRATCH:
+                path = os.path.join(dirName,fileName)
+                if os.path.isfile(path):
+                    found.setdefault(suffix,[]).append((fileName,lambda path=path: os.stat(path)))
+    return found
+
+def NaturalKey(fileName):
+    """ sort key that puts Page2.gif before Page10.gif """
+    return [(int(part) if part.isdigit() else part.lower()) for part in re.split('(\\d+)',fileName)]
+
+"""
+Each piece directory has a Manifest.txt describing its pages, so opening the piece again
+does not need to list the directory or ask for the file type.  The first line is the
+modification time of the directory when the manifest was written, the second the file
+type, then one line per page in page order with its name, full size and modification time:
+
+    1215475200.0
+    .gif
+    Page01.gif 2480 3508 1215475100.0
+"""
+PIECE_MANIFEST = 'Manifest.txt'
+
+RECOGNIZED_EXTENSIONS = ['.gif','.bmp','.tiff','.jpeg','.jpg','.JPG','.png','.pdf']
+
+def ReadManifest(dirName):
+    """ returns (directory mtime, file type, [(pageName,size,mtime),...]) from the manifest, or None """
+    fname = dirName + '/' + PIECE_MANIFEST
+    if not os.path.exists(fname):
+        return None
+    try:
+        f = open(fname,'r')
+        lines = f.readlines()
+        f.close()
+        dirMTime = float(lines[0].strip('\n'))
+        fileType = lines[1].strip('\n')
+        entries = []
+        for line in lines[2:]:
+            fields = line.strip('\n').rsplit(' ',3)
+            size = (int(fields[1]),int(fields[2]))
+            if size[0] <= 0:
+                size = None
+            entries.append((fields[0],size,float(fields[3])))
+    except (IOError,IndexError,ValueError):
+        return None
+    return (dirMTime,fileType,entries)
+
+# directories of a program are checked and read this many at a time, which hides
+# the latency of a music library on a network share
+PROGRAM_THREADS = 8
+
+def CheckPieceDirectory(dirName):
+    """ returns None if dirName can be a piece, otherwise the reason it can't """
+    if not os.path.exists(dirName):
+        return ''.join(["File ",dirName," does not exist"])
+    if not os.path.isdir(dirName):
+        return ''.join([dirName," is not a directory"])
+    return None
 
 class Annotation:
     """
@@ -69,48 +159,129 @@ class Annotation:
         self.y = pos.y
 
         
+class PieceHandle:
+    """
+    Stands in for one piece of a program until it is needed.
+    Knows the name of the piece without touching its directory; GetPiece builds the Piece
+    the first time.  With interactive False (the background warmer) nothing is shown to the
+    user: a piece that would need a question answered is left for the next interactive call.
+    """
+    def __init__(self, dirName):
+        self.name = dirName
+        d = dirName.split('/')
+        self.shortName = d[len(d)-1]
+        self.piece = None
+        self.needsUser = False
+        self.lock = threading.Lock()
+
+    def GetPiece(self, interactive=True):
+        with self.lock:
+            if self.piece == None and (interactive or not self.needsUser):
+                piece = Piece(self.name, interactive)
+                if piece.needsUser:
+                    self.needsUser = True
+                else:
+                    self.piece = piece
+            return self.piece
+
+    def PeekPiece(self):
+        """ returns the piece if it has been read already, never waiting for or doing the read """
+        return self.piece
+
+    def IsLoaded(self):
+        return self.piece != None
+
+
 class Program:
     """ Program Definition 
         Methods: 
-            GetPieces - Given a file name, reads in each line of the file and creates one piece (object) per line
+            GetPieces - Given a file name, reads in each line of the file and makes one piece handle per line
+        The pieces are only read when first shown; a background thread reads them
+        ahead in program order so moving to the next piece is normally instant.
     """
     def __init__(self, fileName=None):
         self.fileName=fileName
         self.pieces=[]
         self.nPieces = 0
         self.currentPiece = None
+        self.currentIndex = None
+        self.byName = {}
         if fileName != None:
             self.GetPieces(fileName)
 
     def GetPieces(self,fileName):
         self.pieces=[]
+        self.byName = {}
         self.nPieces = 0
         self.currentPiece = None
+        self.currentIndex = None
         if self.fileName == None:
             return False
         else: 
             f = open(fileName,'r')
             lines = f.readlines()
             f.close()
-            for dirName in lines:
-                dirName = dirName[0:len(dirName)-1] # remove \n
-                if not os.path.exists(dirName):
-                    msg=''.join(["File ",dirName," does not exist... Aborting"])
-                    wx.MessageBox(msg,'Getting Pieces')
-                    self.nPieces = 0
-                    self.pieces=[]
-                    self.currentPiece=None
-                    self.fileName=None
-                    return None
-                self.pieces.append(Piece(dirName))
+            dirNames = [line.rstrip('\r\n') for line in lines if line.strip()]
+            # check every directory at once and report all the problems together
+            pool = ThreadPool(PROGRAM_THREADS)
+            errors = pool.map(CheckPieceDirectory,dirNames)
+            pool.close()
+            for (dirName,error) in zip(dirNames,errors):
+                if error == None:
+                    self.pieces.append(PieceHandle(dirName))
+            errors = [error for error in errors if error != None]
+            if errors:
+                msg = '\n'.join(["These pieces were left out of the program:"] + errors)
+                wx.MessageBox(msg,'Getting Pieces')
             self.nPieces = len(self.pieces)
+            # pieces can be looked up by their directory or their short name
+            self.byName = {}
+            for i in range(0,self.nPieces):
+                self.byName.setdefault(self.pieces[i].name,i)
+                self.byName.setdefault(self.pieces[i].shortName,i)
             if self.nPieces > 0:
-                self.currentPiece = self.pieces[0]
+                self.SetCurrentIndex(0)
+                t = threading.Thread(target=self.WarmPieces,args=(self.pieces,))
+                t.setDaemon(True)
+                t.start()
                 return True
             else:
                 self.currentPiece = None
+                if errors:
+                    self.fileName = None
+                    return None
                 return False
-            
+
+    def WarmPieces(self, handles):
+        """
+        reads the pieces of handles on a pool of threads, handing them out in program order,
+        until another program is loaded
+        """
+        def warm(handle):
+            if self.pieces is not handles:
+                return
+            try:
+                handle.GetPiece(False)
+            except:
+                pass
+        pool = ThreadPool(PROGRAM_THREADS)
+        pool.map(warm,handles,1)
+        pool.close()
+
+    def SetCurrentIndex(self, idx):
+        self.currentIndex = idx
+        self.currentPiece = self.pieces[idx].GetPiece()
+
+    def IndexOf(self, piece):
+        """ returns the position of piece in the program, or None """
+        if piece == None:
+            return None
+        if piece is self.currentPiece and self.currentIndex != None:
+            return self.currentIndex
+        for i in range(0,len(self.pieces)):
+            if self.pieces[i].piece is piece:
+                return i
+        return None
 
     def NumberOfPieces(self, name):
         return self.nPieces
@@ -132,6 +303,8 @@ class Program:
         self.fileName = None
         self.nPieces = 0
         self.pieces = []
+        self.currentIndex = None
+        self.byName = {}
         
     def GetName(self):
         return self.fileName
@@ -142,42 +315,49 @@ class Program:
     def SetCurrentPiece(self, piece=None):
         if piece != None:
             self.currentPiece = piece
+            self.currentIndex = self.IndexOf(piece)
         return
     
+    def GetNextPiece(self, piece):
+        """
+        returns the piece after 'piece' in the program without changing the current piece,
+        or None if it has not been read yet.  Never reads it: that is left to the
+        background warmer, so the caller (the UI thread) never waits on a directory scan.
+        """
+        idx = self.IndexOf(piece)
+        if idx == None:
+            return None
+        if idx+1 < len(self.pieces):
+            return self.pieces[idx+1].PeekPiece()
+        return None
+
     def NextPiece(self):
         if len(self.pieces) == 1:
             return self.currentPiece
-        try:
-            if self.pieces.index(self.currentPiece) == len(self.pieces)-1:
-                return self.currentPiece
-            self.currentPiece = self.pieces[self.pieces.index(self.currentPiece)+1]
-            return self.currentPiece
-        except ValueError:
+        idx = self.IndexOf(self.currentPiece)
+        if idx == None or idx == len(self.pieces)-1:
             return self.currentPiece
+        self.SetCurrentIndex(idx+1)
+        return self.currentPiece
         
         
     def SetPieceByName(self,name):
-        """ changes current piece to the one named """
-	found = 0
-        for p in self.pieces:
-            if p.name == name:
-		found = 1
-                self.currentPiece = p
-	if found: 
-		return 1
-	else:
-		return 0
+        """ changes current piece to the one named by its directory or short name """
+        idx = self.byName.get(name)
+        if idx == None:
+            return 0
+        self.SetCurrentIndex(idx)
+        return 1
                 
     
     def PrevPiece(self):
         if (len(self.pieces)) == 1:
             return self.currentPiece
-        try:
-            if self.pieces.index(self.currentPiece) == 0:
-                return self.currentPiece
-        except ValueError: 
+        idx = self.IndexOf(self.currentPiece)
+        if idx == None or idx == 0:
             return self.currentPiece
-        self.currentPiece = self.pieces[self.pieces.index(self.currentPiece)-1]
+        self.SetCurrentIndex(idx-1)
+        return self.currentPiece
         
         
 
@@ -198,15 +378,33 @@ class Bookmark:
     def GetPageNumber(self):
         return self.pageNumber
     
+ANNOTATION_CELL = 32
+
+# page revisions are drawn from one counter, so a page that is read again (and so is
+# a new Page) never repeats a revision a drawing was cached under
+pageRevisions = itertools.count(1)
+
 class Page:
     """
     Page object contained inside a piece object
     Also contains a list of annotations
+    In enhance mode a scratch file is shown in place of the page file; GetFileName returns
+    the file shown and GetPageFileName the page's own file.
+    revision changes with every change to the annotations, so drawings of them can be cached
+    The annotations are also bucketed in a grid of ANNOTATION_CELL pixel squares
+    so the ones near a point are found without looking at all of them.
     """
     def __init__(self, fname=None, pageNum = None):
         self.name = fname
+        self.scratchName = None
         self.pageNum = pageNum
         self.annotations = []
+        self.grid = {}
+        self.stat = None # os.stat of the page file when the piece was scanned
+        self.mtime = None
+        self.size = None
+        self.revision = pageRevisions.next()
+        self.annotationSource = None
         if fname:
             ext = fname.split('.')
             ext = ext[len(ext)-1]
@@ -229,15 +427,66 @@ class Page:
     def GetPageNumber(self):
         return self.pageNum
     def GetFileName(self):
+        return self.scratchName or self.name
+    def GetPageFileName(self):
         return self.name
+    def SetScratchFile(self,fname=None):
+        """ shows fname instead of the page file, or the page file again if fname is None """
+        self.scratchName = fname
+    def SetStat(self,stat):
+        self.stat = stat
+        self.mtime = stat.st_mtime
+    def GetStat(self):
+        return self.stat
+    def GetMTime(self):
+        return self.mtime
+    def GetFileMTime(self):
+        """ modification time of the file GetFileName names as recorded by the scan, None if not known """
+        if self.scratchName:
+            return None
+        return self.mtime
+    def SetSize(self,size):
+        self.size = size
+    def GetSize(self):
+        """ full (width,height) of the page image, or None if not known """
+        return self.size
+    def Cell(self,annot):
+        return (int(annot.x)//ANNOTATION_CELL,int(annot.y)//ANNOTATION_CELL)
     def AddAnnotation(self,annot):
         self.annotations.append(annot)
+        self.grid.setdefault(self.Cell(annot),[]).append(annot)
+        self.revision = pageRevisions.next()
     def ClearAnnotations(self):
         self.annotations = []
+        self.grid = {}
+        self.revision = pageRevisions.next()
     def RemoveAnnotation(self,annot):
-        for a in self.annotations:
-            if a == annot:
-                self.annotations.remove(a)
+        self.RemoveAnnotations([annot])
+    def RemoveAnnotations(self,annots):
+        """ removes a batch of annotations with one pass over the list """
+        if not annots:
+            return
+        gone = set([id(a) for a in annots])
+        self.annotations = [a for a in self.annotations if id(a) not in gone]
+        for a in annots:
+            cell = self.Cell(a)
+            bucket = [b for b in self.grid.get(cell,[]) if id(b) not in gone]
+            if bucket:
+                self.grid[cell] = bucket
+            elif cell in self.grid:
+                del self.grid[cell]
+        self.revision = pageRevisions.next()
+    def FindAnnotations(self,x,y,d2):
+        """ returns the annotations closer than sqrt(d2) to (x,y) """
+        reach = int(d2**0.5)//ANNOTATION_CELL + 1
+        (cx,cy) = (int(x)//ANNOTATION_CELL,int(y)//ANNOTATION_CELL)
+        found = []
+        for i in range(cx-reach,cx+reach+1):
+            for j in range(cy-reach,cy+reach+1):
+                for a in self.grid.get((i,j),[]):
+                    if ((x-a.x)*(x-a.x)) + ((y-a.y)*(y-a.y)) < d2:
+                        found.append(a)
+        return found
     def GetAnnotations(self):
         return self.annotations
 
@@ -251,11 +500,21 @@ class Piece:
              GetNextPage - returns the next pages 
              TurnForward - turns the current page forward by 1 page (returns True if successful) 
              TurnBackward - turns the current page backward by 1 page (returns True if successful) 
-        
+             GetPageIndex - returns the index of the current page in pages
+    The current page is kept as an index into pages (cursor), and pageIndex maps
+    page numbers to indexes, so moving around a long piece never searches the list.
     """
-    def __init__(self, dirName=None):
-        recognizedExtensions = ['.gif','.bmp','.tiff','.jpeg','.jpg','.JPG','.png','.pdf']
+    def __init__(self, dirName=None, interactive=True):
+        """
+        dirName is the directory of the piece.  With interactive False no message or
+        dialog is shown; needsUser is set instead if one would have been.
+        """
+        self.needsUser = False
+        self.fileType = None # suffix of the page files, e.g. '.gif'
         self.currentPage = None
+        self.nextPage = None
+        self.cursor = None
+        self.pageIndex = {}
         self.name = dirName
         d = dirName.split('/')
         self.shortName = d[len(d)-1]
@@ -266,58 +525,94 @@ class Piece:
         self.timerValue = 10
         if self.name:
             if not os.path.exists(self.name):
+                if not interactive:
+                    self.needsUser = True
+                    return None
                 msg=''.join(["File ",self.name," does not exist... Aborting"])
                 wx.MessageBox(msg,'Piece Initialize')
                 return None                
-            fileList = os.listdir(self.name)
-            matchedPatterns = []
-            matchedPattern = None
-            for suffix in recognizedExtensions:
-                pat = re.compile('.+\\' + suffix)
-                for fileName in fileList:
-                    if pat.match(fileName):
-                        if not matchedPatterns.__contains__(suffix):
-                            matchedPatterns.append(suffix)
-            if len(matchedPatterns) == 0:
-                wx.MessageBox("Sorry, can't find a recognized file type.","Error")
-                return None
-            if len(matchedPatterns) > 1:
-                cft=ChooseFileType(matchedPatterns)
-                if (cft.dlg.ShowModal()==wx.ID_OK):
-                    str = cft.radio.GetStringSelection()
-                    matchedPattern = '.'+str.lower()
-                    matchedPatterns = [matchedPattern]
-                else:
-                    return
-            if len(matchedPatterns) == 1:
-                matchedPattern = matchedPatterns[0]
-            pat = re.compile('.+\\' + matchedPattern)
-            pageNum = 1
-            for fileName in fileList:
-                if pat.match(fileName):
-                    self.pages.append(Page(fileName,pageNum))
+            manifest = self.ReadManifest()
+            if manifest != None and manifest[0] == os.path.getmtime(self.name):
+                # nothing was added or removed since the manifest was written
+                self.fileType = manifest[1]
+                pageNum = 1
+                for (fileName,size,mtime) in manifest[2]:
+                    page = Page(fileName,pageNum)
+                    page.mtime = mtime
+                    page.SetSize(size)
+                    self.pages.append(page)
                     pageNum = pageNum + 1
                     self.nPages = self.nPages + 1
+            else:
+                filesBySuffix = ScanFiles(self.name,RECOGNIZED_EXTENSIONS)
+                matchedPatterns = [suffix for suffix in RECOGNIZED_EXTENSIONS if suffix in filesBySuffix]
+                matchedPattern = None
+                if manifest != None and manifest[1] in matchedPatterns:
+                    # the file type was chosen before, don't ask again
+                    matchedPatterns = [manifest[1]]
+                if not interactive and len(matchedPatterns) != 1:
+                    self.needsUser = True
+                    return None
+                if len(matchedPatterns) == 0:
+                    wx.MessageBox("Sorry, can't find a recognized file type.","Error")
+                    return None
+                if len(matchedPatterns) > 1:
+                    cft=ChooseFileType(matchedPatterns)
+                    if (cft.dlg.ShowModal()==wx.ID_OK):
+                        str = cft.radio.GetStringSelection()
+                        matchedPattern = '.'+str.lower()
+                        matchedPatterns = [matchedPattern]
+                    else:
+                        return
+                if len(matchedPatterns) == 1:
+                    matchedPattern = matchedPatterns[0]
+                files = filesBySuffix.get(matchedPattern,[])
+                files.sort(key=lambda (fileName,stat): NaturalKey(fileName))
+                pageNum = 1
+                for (fileName,stat) in files:
+                    page = Page(fileName,pageNum)
+                    page.SetStat(stat())
+                    page.SetSize(ReadImageSize(self.GetPagePath(page)))
+                    self.pages.append(page)
+                    pageNum = pageNum + 1
+                    self.nPages = self.nPages + 1
+                self.fileType = matchedPattern
+                self.SaveManifest(matchedPattern)
+            self.IndexPages()
             if self.nPages > 0:
-                self.currentPage = self.pages[0]
-                if self.nPages > 1:
-                    self.nextPage = self.pages[1]
-                else:
-                    self.nextPage = self.currentPage
+                self.SetCursor(0)
             else:
-                self.currentPage = None
-                self.nextPage = None
+                self.SetCursor(None)
             self.LoadBookmarks()
             self.LoadParameters()
 
+    def IndexPages(self):
+        """ rebuilds the page number to index map, call after changing pages """
+        self.nPages = len(self.pages)
+        self.pageIndex = {}
+        for i in range(0,self.nPages):
+            self.pageIndex[self.pages[i].pageNum] = i
+
+    def SetCursor(self,idx):
+        """ makes pages[idx] the current page; the next page is the one after it, or itself on the last page """
+        self.cursor = idx
+        if idx == None:
+            self.currentPage = None
+            self.nextPage = None
+            return
+        self.currentPage = self.pages[idx]
+        if idx+1 < self.nPages:
+            self.nextPage = self.pages[idx+1]
+        else:
+            self.nextPage = self.currentPage
+
+    def GetPageIndex(self):
+        return self.cursor
+
     def SetCurrentPage(self,pageNumber):
         if pageNumber+1 > self.nPages:
             return
-        self.currentPage = self.pages[pageNumber]
-        if pageNumber+2 > self.nPages:
-            self.nextPage = self.currentPage
-        else:
-            self.nextPage = self.pages[pageNumber+1]
+        self.SetCursor(pageNumber)
         
     def NumberOfPages(self):
         """ returns the number of pages in the piece """
@@ -331,8 +626,12 @@ class Piece:
         """ Returns the name of the piece (equivalent to the directory) """
         return self.name
 
+    def GetPagePath(self,page):
+        """ Returns the full path of the image file for page """
+        return ''.join([self.name,os.sep,page.GetFileName()])
+
     def GetPreviousPage(self):
-        idx = self.pages.index(self.currentPage)
+        idx = self.cursor
         if idx==0:
             return None
         else:
@@ -343,7 +642,7 @@ class Piece:
         return self.currentPage
     
     def GetNextPage(self):
-        idx = self.pages.index(self.currentPage)
+        idx = self.cursor
         if (idx+1) == self.nPages:
             return None
         else:
@@ -354,13 +653,9 @@ class Piece:
         Turns one page forward 
         returns True if successful, False if on last page.
         """
-        idx = self.pages.index(self.currentPage)
+        idx = self.cursor
         if (idx+1) < self.nPages:
-            self.currentPage = self.pages[self.pages.index(self.currentPage)+1]
-            if (idx+2) < self.nPages: 
-                self.nextPage = self.pages[self.pages.index(self.currentPage)+1]
-            else:
-                self.nextPage = self.currentPage
+            self.SetCursor(idx+1)
             return True
         else:
             return False
@@ -371,19 +666,18 @@ class Piece:
         Returns True if successful, 
         Returns False if on first page.
         """
-        idx = self.pages.index(self.currentPage)
+        idx = self.cursor
         if idx == 0:
             return False
         else:
-            self.nextPage = self.currentPage
-            self.currentPage = self.pages[self.pages.index(self.currentPage)-1]
+            self.SetCursor(idx-1)
             return True
         
     def GetPage(self,pageNum):
-        for p in self.pages:
-            if p.pageNum == pageNum:
-                return p
-        return None
+        idx = self.pageIndex.get(pageNum)
+        if idx == None:
+            return None
+        return self.pages[idx]
         
     def AddBookmark(self,pageNum,pos,num):
         for b in self.bookMarks:
@@ -424,6 +718,80 @@ class Piece:
                 self.AddBookmark(int(lines[idx].strip('\n')),(int(lines[idx+1].strip('\n')),int(lines[idx+2])),int(lines[idx+3].strip('\n')))
                 idx = idx + 4
         
+    def ReadManifest(self):
+        return ReadManifest(self.name)
+
+    def ApplyChanges(self,changes):
+        """
+        Brings the pages up to date with files written or removed in the piece directory
+        while it is open, e.g. by the scanner or a PDF conversion.  changes is a list of
+        (fileName, exists) as reported by a DirectoryWatcher.  Pages stay in natural order
+        and the current page stays current if it is still there.
+        Returns the lists of page file names (added, replaced, removed).
+        """
+        added = []
+        replaced = []
+        removed = []
+        byName = dict([(page.GetPageFileName(),page) for page in self.pages])
+        for (fileName,exists) in changes:
+            suffix = os.path.splitext(fileName)[1]
+            if fileName == ENHANCE_SCRATCH:
+                # enhance mode's work in progress, not a page
+                continue
+            if self.fileType == None and suffix in RECOGNIZED_EXTENSIONS and os.path.splitext(fileName)[0]:
+                # the first page of a piece that was empty decides its file type
+                self.fileType = suffix
+            if suffix != self.fileType:
+                continue
+            path = os.path.join(self.name,fileName)
+            page = byName.get(fileName)
+            if exists and os.path.isfile(path):
+                if page == None:
+                    page = Page(fileName,0)
+                    self.pages.append(page)
+                    byName[fileName] = page
+                    added.append(fileName)
+                else:
+                    replaced.append(fileName)
+                page.SetStat(os.stat(path))
+                page.SetSize(ReadImageSize(path))
+            elif not exists and page != None and not os.path.exists(path):
+                self.pages.remove(page)
+                del byName[fileName]
+                removed.append(fileName)
+        if added or removed:
+            current = self.currentPage
+            self.pages.sort(key=lambda page: NaturalKey(page.GetPageFileName()))
+            for i in range(0,len(self.pages)):
+                self.pages[i].pageNum = i+1
+            self.IndexPages()
+            if self.nPages == 0:
+                self.SetCursor(None)
+            elif current in self.pages:
+                self.SetCursor(self.pages.index(current))
+            else:
+                self.SetCursor(min(self.cursor or 0,self.nPages-1))
+        if added or replaced or removed:
+            self.SaveManifest(self.fileType)
+        return (added,replaced,removed)
+
+    def SaveManifest(self,fileType):
+        fname = self.name + '/' + PIECE_MANIFEST
+        try:
+            if not os.path.exists(fname):
+                # creating the file changes the directory mtime, so do that before reading it
+                open(fname,'w').close()
+            dirMTime = os.path.getmtime(self.name)
+            f = open(fname,'w')
+            f.writelines([repr(dirMTime),'\n',fileType,'\n'])
+            for page in self.pages:
+                (width,height) = page.GetSize() or (0,0)
+                f.writelines([page.GetPageFileName(),' ',str(width),' ',str(height),' ',repr(page.GetMTime()),'\n'])
+            f.close()
+        except (IOError,OSError):
+            # a read only library just gets scanned every time
+            pass
+
     def LoadParameters(self):
         fname = self.name + '/Parameters.txt'
         if os.path.exists(fname):
@@ -448,11 +816,7 @@ class Piece:
     def GoToBookmark(self,num):
         for b in self.bookMarks:
             if b.number == num:
-                self.currentPage = self.GetPage(b.pageNumber)
-                if self.GetPage(b.pageNumber + 1):
-                    self.nextPage = self.GetPage(b.pageNumber + 1)
-                else:
-                    self.nextPage = self.currentPage
+                self.SetCursor(self.pageIndex.get(b.pageNumber))
                 return b.position
         return None
     
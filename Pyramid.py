@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# Copyright 2008 Michael Toth
+"""
+Virtual Page Turner, a program to help musicians view and turn pages using a computer.
+
+    Copyright (C) 2008  Michael Toth
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import wx
+import os
+import threading
+import Queue
+from ImageCache import DecodeReducedJPEG, JPEG_EXTENSIONS, PILImage
+
+"""
+Scanned pages are much bigger than the screen, so each page of a piece gets
+downsampled copies at 1/2, 1/4 and 1/8 of full size.  They are kept in a
+'pyramid' directory inside the piece, next to the 'original' directory used
+by enhance mode:
+
+    <piece>/pyramid/Page01.gif.2.png
+    <piece>/pyramid/Page01.gif.4.png
+    <piece>/pyramid/Page01.gif.8.png
+    <piece>/pyramid/Pyramid.txt
+
+Pyramid.txt has one line per page with the page file name, its full size
+and the modification time of the page when the levels were made:
+
+    Page01.gif 4960 7016 1215475200.0
+"""
+PYRAMID_DIR = 'pyramid'
+PYRAMID_INDEX = 'Pyramid.txt'
+PYRAMID_LEVELS = [2,4,8]
+
+class PagePyramid:
+    """
+    The downsampled levels of the pages in one piece directory.
+    Methods are:
+       Build(pageName) - makes the levels for one page (slow, call from a worker thread)
+       IsCurrent(pageName) - True if the levels exist and are newer than the page
+       ChooseFile(pageName,targetX,targetY) - the smallest level at least as big as the target
+    """
+    def __init__(self, dirName):
+        self.dirName = dirName
+        self.pyramidDir = ''.join([dirName,os.sep,PYRAMID_DIR])
+        self.sizes = {}
+        self.lock = threading.Lock()
+        self.Load()
+
+    def LevelPath(self, pageName, level):
+        return ''.join([self.pyramidDir,os.sep,pageName,'.',str(level),'.png'])
+
+    def PagePath(self, pageName):
+        return ''.join([self.dirName,os.sep,pageName])
+
+    def Load(self):
+        fname = self.pyramidDir + os.sep + PYRAMID_INDEX
+        if os.path.exists(fname):
+            f = open(fname,'r')
+            lines = f.readlines()
+            f.close()
+            for line in lines:
+                fields = line.strip('\n').rsplit(' ',3)
+                if len(fields) == 4:
+                    self.sizes[fields[0]] = (int(fields[1]),int(fields[2]),float(fields[3]))
+
+    def Save(self):
+        fname = self.pyramidDir + os.sep + PYRAMID_INDEX
+        with self.lock:
+            entries = self.sizes.items()
+        f = open(fname,'w')
+        for pageName,(width,height,mtime) in entries:
+            f.writelines([pageName,' ',str(width),' ',str(height),' ',repr(mtime),'\n'])
+        f.close()
+
+    def IsCurrent(self, pageName):
+        with self.lock:
+            entry = self.sizes.get(pageName)
+        if entry == None:
+            return False
+        try:
+            mtime = os.path.getmtime(self.PagePath(pageName))
+        except OSError:
+            return False
+        return mtime == entry[2]
+
+    def Build(self, pageName):
+        """ decodes the page once and writes each level by halving the one before it """
+        fileName = self.PagePath(pageName)
+        if not os.path.exists(fileName):
+            return False
+        mtime = os.path.getmtime(fileName)
+        if not os.path.exists(self.pyramidDir):
+            os.mkdir(self.pyramidDir)
+        if PILImage != None and pageName.split('.')[-1] in JPEG_EXTENSIONS:
+            # the first level comes straight out of the JPEG decoder at half size
+            try:
+                (width, height) = PILImage.open(fileName).size
+                image = DecodeReducedJPEG(fileName, 2)
+            except Exception:
+                # PIL can't read it; the page is shown from the full size decode instead
+                return False
+            image.SaveFile(self.LevelPath(pageName,2),wx.BITMAP_TYPE_PNG)
+            level = 2
+        else:
+            image = wx.Image(fileName)
+            width = image.GetWidth()
+            height = image.GetHeight()
+            level = 1
+        if not image.Ok():
+            return False
+        for nextLevel in PYRAMID_LEVELS:
+            if nextLevel <= level:
+                continue
+            factor = nextLevel/level
+            image = image.Scale(max(1,image.GetWidth()/factor),max(1,image.GetHeight()/factor),
+                                wx.IMAGE_QUALITY_HIGH)
+            image.SaveFile(self.LevelPath(pageName,nextLevel),wx.BITMAP_TYPE_PNG)
+            level = nextLevel
+        with self.lock:
+            self.sizes[pageName] = (width,height,mtime)
+        self.Save()
+        return True
+
+    def GetSize(self, pageName):
+        """ Returns the full (width,height) of a page, or None if it has no pyramid """
+        with self.lock:
+            entry = self.sizes.get(pageName)
+        if entry == None:
+            return None
+        return (entry[0],entry[1])
+
+    def ChooseFile(self, pageName, targetX, targetY):
+        """
+        Returns the file to decode for a page shown at targetX by targetY pixels:
+        the smallest pyramid level that is still at least that big, or the page itself.
+        A target dimension of 0 is not constrained.
+        """
+        if not self.IsCurrent(pageName):
+            return self.PagePath(pageName)
+        (width,height) = self.GetSize(pageName)
+        choice = self.PagePath(pageName)
+        for level in PYRAMID_LEVELS:
+            if width/level >= targetX and height/level >= targetY:
+                choice = self.LevelPath(pageName,level)
+            else:
+                break
+        return choice
+
+
+class PyramidBuilder:
+    """
+    Builds page pyramids on a background thread.
+    Pieces opened for the first time are back-filled by QueuePiece,
+    and newly imported directories by QueueDirectory.
+    onBuilt, if given, is called (on the builder thread) with the path of each level written,
+    so stale decoded copies of a rebuilt level can be dropped.
+    """
+    def __init__(self, onBuilt=None):
+        self.onBuilt = onBuilt
+        self.pyramids = {}
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+        self.pending = set()
+        t = threading.Thread(target=self.Run)
+        t.setDaemon(True)
+        t.start()
+
+    def GetPyramid(self, dirName):
+        with self.lock:
+            pyramid = self.pyramids.get(dirName)
+            if pyramid == None:
+                pyramid = PagePyramid(dirName)
+                self.pyramids[dirName] = pyramid
+        return pyramid
+
+    def QueuePiece(self, piece):
+        """ queues every page of piece that has no up to date pyramid """
+        if piece == None:
+            return
+        pyramid = self.GetPyramid(piece.GetName())
+        for page in piece.pages:
+            pageName = page.GetPageFileName()
+            if not pyramid.IsCurrent(pageName):
+                self.QueuePage(piece.GetName(),pageName)
+
+    def QueueDirectory(self, dirName, extensions):
+        """ queues every image in dirName whose suffix is in extensions """
+        if not os.path.isdir(dirName):
+            return
+        pyramid = self.GetPyramid(dirName)
+        for pageName in os.listdir(dirName):
+            if pageName.split('.')[-1] in extensions and not pyramid.IsCurrent(pageName):
+                self.QueuePage(dirName,pageName)
+
+    def QueuePage(self, dirName, pageName):
+        with self.lock:
+            if (dirName,pageName) in self.pending:
+                return
+            self.pending.add((dirName,pageName))
+        self.queue.put((dirName,pageName))
+
+    def ChooseFile(self, dirName, pageName, targetX, targetY):
+        return self.GetPyramid(dirName).ChooseFile(pageName,targetX,targetY)
+
+    def Run(self):
+        while True:
+            (dirName,pageName) = self.queue.get()
+            try:
+                pyramid = self.GetPyramid(dirName)
+                if pyramid.Build(pageName) and self.onBuilt:
+                    for level in PYRAMID_LEVELS:
+                        self.onBuilt(pyramid.LevelPath(pageName,level))
+            except:
+                pass
+            with self.lock:
+                self.pending.discard((dirName,pageName))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# Copyright 2008 Michael Toth
+"""
+Virtual Page Turner, a program to help musicians view and turn pages using a computer.
+
+    Copyright (C) 2008  Michael Toth
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+import sys
+import struct
+import select
+import threading
+import time
+
+# inotify is reached through ctypes so nothing has to be installed; elsewhere the directory is polled
+try:
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    libc.inotify_init
+    libc.inotify_add_watch
+except (ImportError, OSError, AttributeError):
+    libc = None
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+WATCHED_EVENTS = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+EVENT_HEADER = 'iIII'
+EVENT_HEADER_SIZE = struct.calcsize(EVENT_HEADER)
+
+POLL_INTERVAL = 2.0 # seconds between looks at the directory without inotify
+SETTLE_TIME = 0.2 # seconds of quiet before a burst of changes is reported
+
+class DirectoryWatcher:
+    """
+    Watches one directory (the open piece) for files being written, replaced or removed.
+    onChange(dirName, changes) is called on the watcher thread once the directory has been
+    quiet for SETTLE_TIME, with changes a list of (fileName, exists): exists is True for a
+    file that was written or moved in and False for one that was removed or moved away.
+    Uses inotify on Linux and polls every POLL_INTERVAL seconds elsewhere.
+    Methods are:
+       Watch(dirName) - watches dirName instead of the directory watched so far (None for none)
+       UsesInotify() - True if changes are seen through inotify
+    """
+    def __init__(self, onChange):
+        self.onChange = onChange
+        self.dirName = None
+        self.lock = threading.Lock()
+        self.fd = -1
+        self.wd = -1
+        if libc != None:
+            self.fd = libc.inotify_init()
+        if self.fd >= 0:
+            target = self.RunInotify
+        else:
+            target = self.RunPolling
+        t = threading.Thread(target=target)
+        t.setDaemon(True)
+        t.start()
+
+    def UsesInotify(self):
+        return self.fd >= 0
+
+    def Watch(self, dirName):
+        with self.lock:
+            if dirName == self.dirName:
+                return
+            self.dirName = dirName
+            if self.fd >= 0:
+                if self.wd >= 0:
+                    libc.inotify_rm_watch(self.fd, self.wd)
+                    self.wd = -1
+                if dirName != None:
+                    path = dirName
+                    if isinstance(path, unicode):
+                        path = path.encode(sys.getfilesystemencoding())
+                    self.wd = libc.inotify_add_watch(self.fd, path, WATCHED_EVENTS)
+
+    def Report(self, dirName, changes):
+        with self.lock:
+            if dirName != self.dirName:
+                return
+        if changes:
+            try:
+                self.onChange(dirName, changes)
+            except:
+                pass
+
+    def RunInotify(self):
+        pending = {}
+        pendingDir = None
+        while True:
+            if pending:
+                timeout = SETTLE_TIME
+            else:
+                timeout = None
+            (ready, w, x) = select.select([self.fd], [], [], timeout)
+            if not ready:
+                # quiet for long enough, report the burst
+                self.Report(pendingDir, pending.items())
+                pending = {}
+                continue
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                continue
+            offset = 0
+            while offset + EVENT_HEADER_SIZE <= len(data):
+                (wd, mask, cookie, length) = struct.unpack_from(EVENT_HEADER, data, offset)
+                offset = offset + EVENT_HEADER_SIZE
+                name = data[offset:offset+length].rstrip('\0')
+                offset = offset + length
+                with self.lock:
+                    current = (wd == self.wd)
+                    dirName = self.dirName
+                if not current or not name:
+                    continue
+                if dirName != pendingDir:
+                    pending = {}
+                    pendingDir = dirName
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    pending[name] = True
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    pending[name] = False
+
+    def Snapshot(self, dirName):
+        """ (size, mtime) of every file in dirName """
+        files = {}
+        try:
+            names = os.listdir(dirName)
+        except OSError:
+            return files
+        for name in names:
+            try:
+                st = os.stat(os.path.join(dirName, name))
+            except OSError:
+                continue
+            files[name] = (st.st_size, st.st_mtime)
+        return files
+
+    def RunPolling(self):
+        watched = None
+        files = {}
+        while True:
+            time.sleep(POLL_INTERVAL)
+            with self.lock:
+                dirName = self.dirName
+            if dirName == None:
+                watched = None
+                continue
+            now = self.Snapshot(dirName)
+            if dirName != watched:
+                watched = dirName
+                files = now
+                continue
+            changes = []
+            for (name, info) in now.items():
+                if files.get(name) != info:
+                    changes.append((name, True))
+            for name in files:
+                if name not in now:
+                    changes.append((name, False))
+            files = now
+            self.Report(dirName, changes)
@@ -110,6 +110,109 @@ class ImageMagickPanel(wx.Dialog):
 
             
     
+class FontTable:
+    """
+    Fonts shared by annotations.  Each distinct (pointSize, family, style, weight,
+    encoding, faceName) is created once and the same wx.Font is handed out after that,
+    so fonts in the table must never be modified; ask for a new one instead.
+    Methods are:
+       GetFont(pointSize,family,style,weight,encoding,faceName) - the shared font
+       Intern(font) - the shared font equal to font
+       Resize(font,pointSize) - the shared font like font but at pointSize
+       GetTextExtent(font,text) - (width,height) of text in font, measured once
+    """
+    def __init__(self):
+        self.fonts = {}
+        self.extents = {}
+
+    def Key(self,font):
+        return (font.GetPointSize(),font.GetFamily(),font.GetStyle(),font.GetWeight(),
+                font.GetEncoding(),font.GetFaceName())
+
+    def GetFont(self,pointSize,family,style,weight,encoding,faceName=''):
+        key = (pointSize,family,style,weight,encoding,faceName)
+        font = self.fonts.get(key)
+        if font == None:
+            font = wx.Font(pointSize=pointSize,family=family,style=style,
+                           weight=weight,encoding=encoding)
+            if faceName:
+                font.SetFaceName(faceName)
+            self.fonts[key] = font
+        return font
+
+    def Intern(self,font):
+        if font == None:
+            return None
+        return self.Resize(font,font.GetPointSize())
+
+    def Resize(self,font,pointSize):
+        return self.GetFont(pointSize,*self.Key(font)[1:])
+
+    def GetTextExtent(self,font,text):
+        key = (self.Key(font),text)
+        extent = self.extents.get(key)
+        if extent == None:
+            dc = wx.MemoryDC()
+            dc.SetFont(font)
+            extent = dc.GetTextExtent(text)
+            self.extents[key] = extent
+        return extent
+
+fontTable = FontTable()
+
+class GoToPieceDialog(wx.Dialog):
+    """
+    Type-ahead chooser for Go To Piece.  index is a NameIndex whose values are
+    (label, choice) pairs: the list shows the labels of the names matching what is typed,
+    and choice is left holding the value picked, or None.
+    """
+    def __init__(self,index):
+        wx.Dialog.__init__(self,None,-1,"Go To Piece",style=wx.DEFAULT_DIALOG_STYLE|wx.RESIZE_BORDER)
+        self.index = index
+        self.matches = []
+        self.choice = None
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        self.search = wx.TextCtrl(self,-1,style=wx.TE_PROCESS_ENTER)
+        self.list = wx.ListBox(self,-1,size=(400,300))
+        sizer.Add(self.search,0,wx.EXPAND|wx.ALL,10)
+        sizer.Add(self.list,1,wx.EXPAND|wx.LEFT|wx.RIGHT|wx.BOTTOM,10)
+        sizer.Add(self.CreateButtonSizer(wx.OK|wx.CANCEL),0,wx.EXPAND|wx.BOTTOM,10)
+        self.SetSizer(sizer)
+        sizer.Fit(self)
+        self.Bind(wx.EVT_TEXT,self.OnText,self.search)
+        self.Bind(wx.EVT_TEXT_ENTER,self.OnChoose,self.search)
+        self.Bind(wx.EVT_LISTBOX_DCLICK,self.OnChoose,self.list)
+        self.Bind(wx.EVT_BUTTON,self.OnChoose,id=wx.ID_OK)
+        self.search.Bind(wx.EVT_KEY_DOWN,self.OnSearchKey)
+        self.Filter('')
+        self.search.SetFocus()
+
+    def Filter(self,text):
+        self.matches = self.index.Search(text)
+        self.list.Set([label for (label,choice) in self.matches])
+        if self.matches:
+            self.list.SetSelection(0)
+
+    def OnText(self,event):
+        self.Filter(self.search.GetValue())
+
+    def OnSearchKey(self,event):
+        # the arrow keys move through the matches while typing
+        key = event.GetKeyCode()
+        i = self.list.GetSelection()
+        if key == wx.WXK_DOWN and i+1 < len(self.matches):
+            self.list.SetSelection(i+1)
+        elif key == wx.WXK_UP and i > 0:
+            self.list.SetSelection(i-1)
+        else:
+            event.Skip()
+
+    def OnChoose(self,event):
+        i = self.list.GetSelection()
+        if i != wx.NOT_FOUND and i < len(self.matches):
+            self.choice = self.matches[i][1]
+        self.EndModal(wx.ID_OK)
+
 class AnnotationsPanel(wx.Dialog):
     """
     panel to draw annotations using DialogBlocks and xrc resource file
@@ -117,14 +220,11 @@ class AnnotationsPanel(wx.Dialog):
     def __init__(self):
         self.AnnotationText = None
         self.AnnotationFont = None
-        self.accFont = wx.Font(pointSize=20,family=74,
-                               style=90,weight=90,underline=False,encoding=33)
-        self.accFont.SetFaceName('Accidentals')
-        self.txtFont = wx.Font(pointSize=12,
-                               family=wx.FONTFAMILY_DEFAULT,
-                               style=wx.FONTSTYLE_NORMAL,
-                               weight=wx.FONTWEIGHT_NORMAL, 
-                               encoding=wx.FONTENCODING_DEFAULT)
+        self.accFont = fontTable.GetFont(20,74,90,90,33,'Accidentals')
+        self.txtFont = fontTable.GetFont(12,wx.FONTFAMILY_DEFAULT,
+                                         wx.FONTSTYLE_NORMAL,
+                                         wx.FONTWEIGHT_NORMAL,
+                                         wx.FONTENCODING_DEFAULT)
         wx.Dialog.__init__(self, None, -1)
         self.res = xrc.XmlResource('annotations.xrc')
         self.res.LoadDialog(self,"AnnotationDialogBox")
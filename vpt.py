@@ -44,6 +44,13 @@ from simple_base import TwainBase
 import  wx.xrc  as  xrc
 from panels import *
 from Program import *
+from ImageCache import *
+from Pyramid import *
+from PageStrip import *
+from FrameClock import *
+from Catalog import Catalog
+from Watcher import DirectoryWatcher
+from NameIndex import NameIndex, ToText
 
 """
 
@@ -171,6 +178,47 @@ class vptFrame(wx.Frame, TwainBase):
 
         self.timer = wx.Timer(self,1)
         self.Bind(wx.EVT_TIMER,self.OnTimer,self.timer)
+        # Fit Width auto-scroll runs off a frame timer and moves the view at a steady rate
+        self.scrollClock = FrameClock()
+        self.scrollRemainder = 0.0
+        self.smoothTimer = False
+
+        # decoded page images and the background prefetch of upcoming pages
+        prefetchDepth = options.getOption('PREFETCH_DEPTH')
+        if prefetchDepth == '':
+            prefetchDepth = 3
+            options.addOption('PREFETCH_DEPTH',prefetchDepth)
+        imageMemory = options.getOption('IMAGE_MEMORY')
+        if imageMemory == '':
+            imageMemory = 128
+            options.addOption('IMAGE_MEMORY',imageMemory)
+        self.store = PageImageStore(int(imageMemory)*1024*1024)
+        self.pyramidBuilder = PyramidBuilder(onBuilt=self.store.InvalidateImage)
+        renditionCacheSize = options.getOption('RENDITION_CACHE_SIZE')
+        if renditionCacheSize == '':
+            renditionCacheSize = 200
+            options.addOption('RENDITION_CACHE_SIZE',renditionCacheSize)
+        self.renditionCache = RenditionCache(vpthome + os.sep + 'renditions',
+                                             int(renditionCacheSize)*1024*1024)
+        self.pyramidPiece = None
+        self.scheduler = DecodeScheduler(self.store)
+        self.scheduler.SetDepth(int(prefetchDepth))
+        # how close to the end of a piece the next piece of the program is prepared
+        nextPieceLookahead = options.getOption('NEXT_PIECE_LOOKAHEAD')
+        if nextPieceLookahead == '':
+            nextPieceLookahead = 3
+            options.addOption('NEXT_PIECE_LOOKAHEAD',nextPieceLookahead)
+        self.nextPieceLookahead = int(nextPieceLookahead)
+        # catalog of the pieces in the music library, brought up to date in the background
+        # VPT_HOME is the default MUSIC_DIR, so its own directories are kept out of the catalog
+        self.catalog = Catalog(vpthome + os.sep + 'catalog.db',
+                               [vpthome + os.sep + 'renditions', vpthome + os.sep + 'images'])
+        self.catalog.RefreshInBackground(self.MUSIC_DIR)
+        # search index for Go To Piece, rebuilt when the program or the catalog changes
+        self.pieceIndex = None
+        self.pieceIndexKey = None
+        # pages written into the open piece (scanning, PDF conversion) show up without reloading it
+        self.watcher = DirectoryWatcher(self.OnDirectoryChanged)
 
         # page number when acquiring pages from twain source
         self.pageNum = 1
@@ -193,12 +241,26 @@ class vptFrame(wx.Frame, TwainBase):
         self.oldPos = -1 # position of rectangle to move with mouse
         self.annotationText = None
         self.annotationFont = None
+        self.floatingRect = None # where the annotation being placed was last drawn
         self.Annotating = False
         self.currentPage = None
         self.nextPage = None
         self.prevPage = None
         self.page1 = image.ConvertToBitmap()
         self.page2 = self.page1
+        self.file1 = None
+        self.file2 = None
+        self.backBuffer = None
+        self.spareBuffer = None
+        self.backBufferSignature = None
+        # the spread after the next turn in Two Page mode, composed while idle
+        self.nextSpread = None
+        self.nextSpreadSignature = None
+        self.nextSpreadKey = None
+        # layout of the whole piece in Fit Width mode
+        self.strip = None
+        self.stripKey = None
+        self.loadedAnnotations = set()
         self.clientSizeX , self.clientSizeY = self.GetClientSizeTuple()
         self.clientOriginX , self.clientOriginY = self.GetClientAreaOrigin()
 
@@ -209,6 +271,9 @@ class vptFrame(wx.Frame, TwainBase):
         # Bind Keys
         self.Bind(wx.EVT_CHAR, self.OnKeyDown)
         self.Bind(wx.EVT_PAINT, self.OnPaint)
+        # every paint covers its whole update region from the backbuffer, so skip the erase
+        self.Bind(wx.EVT_ERASE_BACKGROUND, self.OnEraseBackground)
+        self.Bind(wx.EVT_IDLE, self.OnIdle)
 
         # Resize Handler
         self.Bind(wx.EVT_SIZE,self.OnResize)
@@ -279,7 +344,7 @@ class vptFrame(wx.Frame, TwainBase):
 
     def ConvertAll(self):
         if self.revertPageName:
-            pgm.currentPiece.GetCurrentPage().SetFileName(self.revertPageName)
+            pgm.currentPiece.GetCurrentPage().SetScratchFile(None)
         self.revertPage = None
         piece = pgm.GetCurrentPiece()
         npages = piece.NumberOfPages()
@@ -339,13 +404,20 @@ class vptFrame(wx.Frame, TwainBase):
         fdir = pgm.currentPiece.GetName()
         page = pgm.currentPiece.GetCurrentPage()
         fname = self.revertPageName
-        src = fdir + os.sep + 'temp.gif'
+        src = fdir + os.sep + ENHANCE_SCRATCH
         if os.path.exists(src):
             dest = fdir + os.sep + fname
             if os.path.exists(dest):
                 os.remove(dest)
                 os.rename(src,dest)
-                pgm.currentPiece.GetCurrentPage().SetFileName(fname)
+                self.store.InvalidateFile(src)
+                self.store.InvalidateFile(dest)
+                self.pyramidBuilder.QueuePage(fdir, fname)
+                page = pgm.currentPiece.GetCurrentPage()
+                page.SetScratchFile(None)
+                # the page is keyed on the mtime recorded by the scan, so record the new one
+                page.SetStat(os.stat(dest))
+                pgm.currentPiece.SaveManifest(pgm.currentPiece.fileType)
                 self.revertPage = None
                 self.revertPageName = None
                 self.enhanceOptions = []
@@ -354,7 +426,7 @@ class vptFrame(wx.Frame, TwainBase):
     def EnhanceImage(self):
         if not self.revertPage:
             self.revertPage = pgm.currentPiece.GetCurrentPage()
-            self.revertPageName = self.revertPage.GetFileName()
+            self.revertPageName = self.revertPage.GetPageFileName()
         page = self.revertPage
         fdir = pgm.currentPiece.GetName()
         fname = self.revertPageName
@@ -363,7 +435,7 @@ class vptFrame(wx.Frame, TwainBase):
         for o in self.enhanceOptions:
             coptions = coptions + o
         # self.enhanceOptions = []
-        dest = fdir + os.sep + 'temp.gif'
+        dest = fdir + os.sep + ENHANCE_SCRATCH
         # self.run('convert',src+coptions+dest)
         cmd = 'convert "' + src + '"' + coptions + '"' + dest + '"'
         if wx.Platform == '__WXMSW__':
@@ -373,7 +445,8 @@ class vptFrame(wx.Frame, TwainBase):
         self.SetStatusText('Processing...' + src + coptions)
         if cvt != "":
             os.system(cmd)
-            page.SetFileName('temp.gif')
+            self.store.InvalidateFile(dest)
+            page.SetScratchFile(ENHANCE_SCRATCH)
             self.LoadCurrentPiece()
         else:
             wx.MessageBox('Can not find convert program.')
@@ -403,7 +476,7 @@ class vptFrame(wx.Frame, TwainBase):
 
     def OnRevert(self,event):
         if self.revertPageName:
-            pgm.currentPiece.GetCurrentPage().SetFileName(self.revertPageName)
+            pgm.currentPiece.GetCurrentPage().SetScratchFile(None)
         self.enhanceOptions = []
         self.revertPage = None
         self.revertPageName = None
@@ -411,7 +484,7 @@ class vptFrame(wx.Frame, TwainBase):
 
     def OnRevertAll(self,event):
         if self.revertPageName:
-            pgm.currentPiece.GetCurrentPage().SetFileName(self.revertPageName)
+            pgm.currentPiece.GetCurrentPage().SetScratchFile(None)
         fdir = pgm.currentPiece.GetName()
         src = fdir + os.sep + 'original' + os.sep + '*.gif'
         dest = fdir
@@ -420,6 +493,12 @@ class vptFrame(wx.Frame, TwainBase):
         else:
             cmd = 'cp "' + src + '" "' + dest + '"'
         os.system(cmd)
+        for page in pgm.currentPiece.pages:
+            path = pgm.currentPiece.GetPagePath(page)
+            if os.path.exists(path):
+                page.SetStat(os.stat(path))
+        pgm.currentPiece.SaveManifest(pgm.currentPiece.fileType)
+        self.store.Clear()
         self.LoadCurrentPiece()
 
     def OnSave(self,event):
@@ -472,6 +551,7 @@ class vptFrame(wx.Frame, TwainBase):
                 # cmd = 'convert ' + path + ' ' + dest + '/Page%03d.gif'
                 self.SetStatusText('Converting...')
                 os.system(cmd)
+                self.pyramidBuilder.QueueDirectory(dest, recognizedExtensions)
                 self.SetStatusText('Done')
                 wx.MessageBox('PDF File is Converted.')
 
@@ -485,6 +565,8 @@ class vptFrame(wx.Frame, TwainBase):
             if wx.Platform == '__WXMSW__':
                 self.ypos = self.ypos+105
         else:
+            if self.revertPage:
+                self.revertPage.SetScratchFile(None)
             self.revertPage = None
             self.toolBarOn = False
             self.toolbar.Hide()
@@ -611,16 +693,41 @@ class vptFrame(wx.Frame, TwainBase):
 # Event Handlers
     def OnGoToPiece(self,event):
         self.GoToPiece()
+    def GetPieceIndex(self):
+        """ the search index of the pieces of the program and of the library catalog """
+        key = (pgm.pieces, self.catalog.GetVersion())
+        if self.pieceIndex != None and key[0] is self.pieceIndexKey[0] and key[1] == self.pieceIndexKey[1]:
+            return self.pieceIndex
+        index = NameIndex()
+        inProgram = set()
+        for handle in pgm.pieces:
+            index.Add(handle.shortName, (ToText(handle.shortName), ('program', handle.name)))
+            inProgram.add(handle.name)
+        for (path, name, fileType, nPages, nBookmarks, lastOpened) in self.catalog.GetPieces():
+            if path not in inProgram:
+                label = u''.join([ToText(name), u'  (', ToText(os.path.dirname(path)), u')'])
+                index.Add(name, (label, ('library', path)))
+        self.pieceIndex = index
+        self.pieceIndexKey = key
+        return index
+
     def GoToPiece(self):
-        pieces = pgm.GetPieceNames()
-        dlg=wx.SingleChoiceDialog( None, "Go To Piece", "Pieces", pieces)
-        dlg.ShowModal()
-        choice = dlg.GetStringSelection()
-        if (pgm.SetPieceByName(choice) == 0):
-        	self.SetStatusText(''.join(["Can't find ", choice]))
-	else:
-        	self.SetStatusText(''.join(['Loading ', choice]))
-        self.LoadCurrentPiece()
+        dlg = GoToPieceDialog(self.GetPieceIndex())
+        if dlg.ShowModal() == wx.ID_OK and dlg.choice != None:
+            (source, name) = dlg.choice
+            if source == 'program':
+                if (pgm.SetPieceByName(name) == 0):
+                    self.SetStatusText(''.join(["Can't find ", name]))
+                else:
+                    self.SetStatusText(''.join(['Loading ', name]))
+            else:
+                # a piece from the library that is not in the program is shown without closing the
+                # program, so Go To Piece can still return to the program's pieces
+                piece = Piece(name)
+                pgm.SetCurrentPiece(piece)
+                self.lastPiece = name
+                self.SetStatusText(''.join(['Loading ', name]))
+            self.LoadCurrentPiece()
         dlg.Destroy()
 
     def OnOpenScanner(self, event):
@@ -687,6 +794,7 @@ class vptFrame(wx.Frame, TwainBase):
                         if errors:
                             wx.MessageBox(errors,'error')
                             return
+                        self.pyramidBuilder.QueueDirectory(destDir, recognizedExtensions)
                         if (wx.MessageBox('PDF File Converted\nDo you want to load the file?',style=wx.YES_NO)==wx.YES):
                             piece = Piece(destDir)
                             pgm.SetCurrentPiece(piece)
@@ -703,6 +811,7 @@ class vptFrame(wx.Frame, TwainBase):
             if event == twain.MSG_XFERREADY:
                 self.AcquirePending = False
                 self.ProcessXFer(self.fname)
+                self.pyramidBuilder.QueuePage(self.dirName, os.path.basename(self.fname))
                 dlg = wx.MessageDialog(self,"Another Page? (Put the new page in the scanner)","Continue scanning",style=wx.YES_NO)
                 rc = dlg.ShowModal()
                 if (rc == wx.ID_YES):
@@ -722,7 +831,14 @@ class vptFrame(wx.Frame, TwainBase):
     def OnOptions(self,event):
         self.SetOptions()
     def OnTimer(self,event):
-        self.forwardOnePage()
+        if self.smoothTimer != self.SmoothScrolling():
+            # the view mode changed under the timer
+            self.TurnOnTimer()
+            return
+        if self.smoothTimer:
+            self.AutoScroll()
+        else:
+            self.forwardOnePage()
 
 
     def OnLoadPiece(self,event):
@@ -825,6 +941,11 @@ class vptFrame(wx.Frame, TwainBase):
         if ck == 'l': # load piece
             self.LoadPiece()
             event.Skip()
+        if ck == 'i': # show image cache statistics
+            self.SetStatusText('   '.join([self.store.GetStatistics(),self.scheduler.GetStatistics(),
+                                            self.renditionCache.GetStatistics(),
+                                            self.scrollClock.GetStatistics()]))
+            event.Skip()
         if ck == 'O': # set options
             self.SetOptions()
             event.Skip()
@@ -865,14 +986,19 @@ class vptFrame(wx.Frame, TwainBase):
             if self.annotationFont:
                 pointSize = self.annotationFont.GetPointSize()
                 pointSize = pointSize + 2
-                self.annotationFont.SetPointSize(pointSize)
+                # fonts are shared, so switch to the larger one rather than changing it
+                self.annotationFont = fontTable.Resize(self.annotationFont,pointSize)
+                if self.floatingRect:
+                    self.floatingRect = self.FloatingTextRect(self.floatingRect.GetPosition())
                 self.Refresh(False)
                 event.Skip()
         if ck == '<' or ck == ',': # decrease font size of annotation
             if self.annotationFont:
                 pointSize = self.annotationFont.GetPointSize()
                 pointSize = pointSize - 2
-                self.annotationFont.SetPointSize(pointSize)
+                self.annotationFont = fontTable.Resize(self.annotationFont,pointSize)
+                if self.floatingRect:
+                    self.floatingRect = self.FloatingTextRect(self.floatingRect.GetPosition())
                 self.Refresh(False)
                 event.Skip()
 
@@ -1011,13 +1137,12 @@ class vptFrame(wx.Frame, TwainBase):
         (x,y) = self.Map2Screen(x,y)
         # mp=self.ScreenToClient(wx.GetMousePosition())
         if self.currentPage:
-            annots = self.currentPage.GetAnnotations()
-            for a in annots:
-                d2 = ((x-a.x)*(x-a.x)) + ((y-a.y)*(y-a.y))
-                if d2<500:
-                    self.currentPage.RemoveAnnotation(a)
-                    self.SaveAnnotations()
-                    self.Refresh()
+            hits = self.currentPage.FindAnnotations(x,y,500)
+            if hits:
+                self.currentPage.RemoveAnnotations(hits)
+                self.SaveAnnotations()
+                self.InvalidateBackBuffer()
+                self.Refresh()
 
     def OnQuit(self,event):
         self.SaveStartup()
@@ -1025,25 +1150,48 @@ class vptFrame(wx.Frame, TwainBase):
         sys.exit()
     def OnPaint(self, event):
         self.DrawImages()
+    def OnEraseBackground(self, event):
+        pass
+    def OnDirectoryChanged(self, dirName, changes):
+        # called on the watcher thread
+        wx.CallAfter(self.ApplyDirectoryChanges, dirName, changes)
+    def OnIdle(self, event):
+        self.ComposeNextSpread()
 
 
     def OnLeftClick(self,event):
         (x,y) = self.ClientToScreen(event.GetPositionTuple())
         (x,y) = self.Map2Screen(x,y)
         mode = options.getOption('VIEW_MODE')
-        a = Annotation(x,y,self.annotationText,self.annotationFont,mode)
+        a = Annotation(x,y,self.annotationText,fontTable.Intern(self.annotationFont),mode)
         self.currentPage.AddAnnotation(a)
         self.SaveAnnotations()
         self.annotationText = None
         self.annotationFont = None
+        self.floatingRect = None
         self.Bind(wx.EVT_MOTION,None)
         self.Bind(wx.EVT_LEFT_DOWN,None)
+        self.InvalidateBackBuffer()
+        self.Refresh(False)
 
     def OnMouseMove(self,event):
-        self.Refresh(False)
+        # only the label moves, so repaint where it was and where it is now
+        rect = self.FloatingTextRect(event.GetPosition())
+        if self.floatingRect == None:
+            self.Refresh(False)
+        else:
+            self.RefreshRect(self.floatingRect,False)
+            self.RefreshRect(rect,False)
+        self.floatingRect = rect
+
+    def FloatingTextRect(self, pos):
+        """ the client rectangle covered by the annotation being placed when the mouse is at pos """
+        (w,h) = fontTable.GetTextExtent(self.annotationFont or wx.NORMAL_FONT, self.annotationText or '')
+        return wx.Rect(pos.x, pos.y, w+1, h+1)
 
     def OnResize(self,event):
         self.clientSizeX , self.clientSizeY = self.GetClientSizeTuple()
+        self.ResizeBackBuffer()
         self.LoadCurrentPiece()
 
     def OnAbout(self,event):
@@ -1192,6 +1340,7 @@ class vptFrame(wx.Frame, TwainBase):
         if (optPanel.dlg.ShowModal()==wx.ID_OK):
             self.MUSIC_DIR = optPanel.musicDir.GetValue()
             options.setOption('MUSIC_DIR',self.MUSIC_DIR)
+            self.catalog.RefreshInBackground(self.MUSIC_DIR)
             self.SCROLL_AMOUNT = int(optPanel.scrollAmount.GetValue())
             options.setOption('SCROLL_AMOUNT',self.SCROLL_AMOUNT)
             if optPanel.twoPage.GetValue():
@@ -1210,28 +1359,98 @@ class vptFrame(wx.Frame, TwainBase):
             self.ypos=0
             self.Refresh(True)
 
+    def ApplyDirectoryChanges(self, dirName, changes):
+        """
+        Updates the open piece with page files written or removed in its directory, dropping
+        the cached images of just those pages, and redisplays it if anything changed.
+        """
+        piece = self.currentPiece
+        if piece == None or piece.GetName() != dirName:
+            return
+        (added, replaced, removed) = piece.ApplyChanges(changes)
+        if not (added or replaced or removed):
+            return
+        pyramid = self.pyramidBuilder.GetPyramid(dirName)
+        for pageName in replaced + removed:
+            self.store.InvalidateFile(''.join([dirName, os.sep, pageName]))
+            for level in PYRAMID_LEVELS:
+                self.store.InvalidateFile(pyramid.LevelPath(pageName, level))
+        for pageName in added + replaced:
+            self.pyramidBuilder.QueuePage(dirName, pageName)
+        # page sizes or the page list changed
+        self.stripKey = None
+        self.nextSpreadSignature = None
+        self.LoadCurrentPiece()
+        self.UpdateStatusBar()
+
+    def SmoothScrolling(self):
+        """ True if auto-scroll moves the Fit Width strip continuously rather than turning pages """
+        return self.VIEWMODE == "Fit Width" and self.strip != None and not self.pdfON
+
     def TurnOnTimer(self):
-        self.timer.Start(options.getOption('TIMER_VALUE')*1000)
+        self.smoothTimer = self.SmoothScrolling()
+        if self.smoothTimer:
+            self.scrollClock.Start()
+            self.scrollRemainder = 0.0
+            self.timer.Start(FRAME_INTERVAL)
+        else:
+            self.timer.Start(options.getOption('TIMER_VALUE')*1000)
     def TurnOffTimer(self):
         self.timer.Stop()
     def SpeedUpTimer(self):
         speed = options.getOption('TIMER_VALUE')*1000.0
         speed = speed-(0.1*speed)
         options.setOption('TIMER_VALUE',speed/1000.0)
-        if self.timer.IsRunning():
+        # the smooth scroll reads the rate every frame, so only the page timer needs restarting
+        if self.timer.IsRunning() and not self.smoothTimer:
             self.timer.Start(speed)
 
     def SlowDownTimer(self):
         speed = options.getOption('TIMER_VALUE')*1000.0
         speed = speed + (0.1*speed)
         options.setOption('TIMER_VALUE',speed/1000.0)
-        self.timer.Start(speed)
+        if self.timer.IsRunning() and not self.smoothTimer:
+            self.timer.Start(speed)
+
+    def AutoScroll(self):
+        """
+        One frame of the smooth auto-scroll: moves the strip by SCROLL_AMOUNT pixels
+        every TIMER_VALUE seconds, pro rata to the time since the last frame.
+        Fractions of a pixel are carried to the next frame so the backbuffer stays aligned.
+        """
+        if self.revertPage:
+            pgm.currentPiece.GetCurrentPage().SetScratchFile(None)
+            self.revertPage = None
+            self.revertPageName = None
+        elapsed = self.scrollClock.Tick()
+        rate = float(options.getOption('SCROLL_AMOUNT'))/max(0.001,float(options.getOption('TIMER_VALUE')))
+        self.scrollRemainder = self.scrollRemainder + rate*elapsed
+        amount = int(self.scrollRemainder)
+        if amount == 0:
+            return
+        self.scrollRemainder = self.scrollRemainder - amount
+        oldTop = self.ViewTop()
+        self.ScrollStrip(amount)
+        if self.ViewTop() == oldTop:
+            # reached the end of the piece
+            self.TurnOffTimer()
+            return
+        self.Update()
 
     def LoadCurrentPiece(self):
         self.currentPiece = pgm.GetCurrentPiece()
         if self.currentPiece:
             self.pieceName = self.currentPiece.GetName()
             self.currentPage = self.currentPiece.GetCurrentPage()
+            if self.pyramidPiece != self.currentPiece:
+                # back-fill pyramids for pieces imported before they existed
+                self.pyramidPiece = self.currentPiece
+                self.pyramidBuilder.QueuePiece(self.currentPiece)
+                self.catalog.MarkOpened(self.currentPiece)
+                self.watcher.Watch(self.currentPiece.GetName())
+            if self.currentPage == None:
+                # nothing of this piece to lay out; the old strip belongs to another piece
+                self.ForgetStrip()
             timerValue = self.currentPiece.timerValue
             options.setOption('TIMER_VALUE',timerValue)
             scrollAmount = self.currentPiece.scrollAmount
@@ -1242,20 +1461,20 @@ class vptFrame(wx.Frame, TwainBase):
                     self.pdfON = False
                     if self.pdf:
                         self.pdf.Hide()
-                    pageName = self.currentPage.GetFileName()
                     self.Bind(wx.EVT_PAINT, self.OnPaint)
-                    fileName = ''.join([self.pieceName,os.sep,pageName])
-                    self.image1 = wx.Image(fileName)
+                    self.file1 = self.currentPiece.GetPagePath(self.currentPage)
+                    if self.VIEWMODE == "Fit Width":
+                        self.BuildStrip()
                     self.GetAnnotations()
+                    self.InvalidateBackBuffer()
                     self.nextPage = self.currentPiece.GetNextPage()
                     if self.nextPage != None:
-                        pageName = self.nextPage.GetFileName()
-                        fileName = ''.join([self.pieceName , os.sep , pageName])
-                        self.image2 = wx.Image(fileName)
+                        self.file2 = self.currentPiece.GetPagePath(self.nextPage)
                     else:
-                        self.image2 = self.image1
-                    self.SetImages(self.image1, self.image2)
+                        self.file2 = self.file1
+                    self.SetPages(self.file1, self.file2, self.currentPage, self.nextPage or self.currentPage)
                     self.Refresh(True)
+                    self.ScheduleDecodes()
                 else:
                     if self.pdf:
                         self.pdfON=True
@@ -1272,6 +1491,7 @@ class vptFrame(wx.Frame, TwainBase):
                         self.pdf.SetFocus()
                         self.pdf.Show()
             else:
+                self.ForgetStrip()
                 self.image1 = wx.Image('Welcome.gif')
                 self.image2 = wx.Image('Welcome.gif')                    
 
@@ -1310,16 +1530,128 @@ class vptFrame(wx.Frame, TwainBase):
             image.Rescale(wfacx*iSizeX,wfacy*iSizeY)
         return image
 
-    def SetImages(self, image1=None, image2=None):
+    def GetPageBitmap(self, fileName, page=None):
         """
-        sets the images in the frame. 
-        rescales according to view mode
+        returns the bitmap for fileName scaled for the current view mode and window size.
+        Uses the page image store so a page already shown at this size is not decoded or rescaled again.
+        page is the Page of fileName, if known, so the bitmap is keyed without a stat.
         """
+        mtime = self.PageMTime(page)
+        key = self.store.MakeBitmapKey(fileName, self.VIEWMODE, self.clientSizeX, self.clientSizeY, mtime)
+        bitmap = self.store.GetBitmap(key)
+        if bitmap == None:
+            targetSize = self.TargetSize()
+            image = self.renditionCache.GetImage(fileName, targetSize)
+            if image == None:
+                image = self.scaleImage(self.store.GetImage(self.ResolvePageFile(fileName, page and page.GetSize())))
+                self.renditionCache.Put(fileName, targetSize, image.Copy())
+            bitmap = image.ConvertToBitmap()
+            self.store.PutBitmap(key, bitmap)
+        return bitmap
+
+    def PageMTime(self, page):
+        """ modification time of the file shown for page as recorded when the piece was scanned, or None """
+        if page == None:
+            return None
+        return page.GetFileMTime()
+
+    def TargetSize(self):
+        """ returns the (width,height) a page is scaled to in the current view mode, 0 if unconstrained """
+        if self.VIEWMODE == "Two Page":
+            return (self.clientSizeX/2, self.clientSizeY)
+        return (self.clientSizeX, 0)
+
+    def ResolvePageFile(self, fileName, size=None):
+        """
+        returns the decode key for the page fileName at the target size: the smallest pyramid
+        level that still covers it or, failing that, a reduced size JPEG decode of the page.
+        size is the full size of the page if it is known (Page.GetSize); otherwise the
+        file header of a JPEG page is read.
+        """
+        (dirName, pageName) = os.path.split(fileName)
+        (targetX, targetY) = self.TargetSize()
+        choice = self.pyramidBuilder.ChooseFile(dirName, pageName, targetX, targetY)
+        if choice == fileName:
+            if size == None and fileName.split('.')[-1] in JPEG_EXTENSIONS:
+                # only a JPEG decode can be reduced, so only a JPEG needs its size
+                size = ReadImageSize(fileName)
+            reduction = ChooseReduction(fileName, size, targetX, targetY)
+            choice = DecodeKey(fileName, reduction)
+        return choice
+
+    def ScheduleDecodes(self):
+        """
+        Queues background decodes around the current page: the visible pages first,
+        then the next and previous pages, the bookmarked pages, the first page of
+        the next piece and finally the pages further ahead.
+        Within nextPieceLookahead pages of the end of the piece the opening pages of
+        the next piece in the program are also scaled and converted, so 'F' shows them at once.
+        Anything queued for the old position is cancelled, so jumps stay fast.
+        """
+        piece = self.currentPiece
+        if piece == None or piece.GetCurrentPage() == None:
+            self.scheduler.Cancel()
+            return
+        requests = []
+        def request(priority, p, page):
+            if page != None:
+                requests.append((priority, self.ResolvePageFile(p.GetPagePath(page), page.GetSize())))
+        idx = piece.GetPageIndex()
+        request(PRIORITY_VISIBLE, piece, piece.GetCurrentPage())
+        if self.VIEWMODE == "Two Page":
+            request(PRIORITY_VISIBLE, piece, piece.GetNextPage())
+            if idx + 2 < len(piece.pages):
+                # the page that comes into view on the next turn, scaled ready for ComposeNextSpread
+                page = piece.pages[idx + 2]
+                fileName = piece.GetPagePath(page)
+                requests.append((PRIORITY_NEXT, self.ResolvePageFile(fileName, page.GetSize()),
+                                 self.MakePrescaler(fileName, page)))
+        request(PRIORITY_NEXT, piece, piece.GetNextPage())
+        request(PRIORITY_PREVIOUS, piece, piece.GetPreviousPage())
+        for b in piece.bookMarks:
+            request(PRIORITY_BOOKMARK, piece, piece.GetPage(b.GetPageNumber()))
+        nextPiece = pgm.GetNextPiece(piece)
+        if nextPiece != None and nextPiece.pages:
+            if len(piece.pages) - idx <= self.nextPieceLookahead:
+                for page in nextPiece.pages[0:2]:
+                    requests.append((PRIORITY_NEXT_PIECE, self.ResolvePageFile(nextPiece.GetPagePath(page), page.GetSize()),
+                                     self.MakePrescaler(nextPiece.GetPagePath(page), page)))
+            else:
+                request(PRIORITY_NEXT_PIECE, nextPiece, nextPiece.pages[0])
+        for distance in range(2, self.scheduler.depth + 1):
+            if idx + distance < len(piece.pages):
+                request(PRIORITY_AHEAD + distance, piece, piece.pages[idx + distance])
+        self.scheduler.Schedule(requests)
 
-        if image1 != None:
-            img1 = self.scaleImage(image1)
-            img2 = self.scaleImage(image2)
-            self.ConvertImages(img1, img2)
+    def MakePrescaler(self, fileName, page=None):
+        """
+        returns a decode callback that scales the image of the page fileName on the
+        decode thread and hands it to the main thread to become a cached bitmap
+        """
+        key = self.store.MakeBitmapKey(fileName, self.VIEWMODE, self.clientSizeX, self.clientSizeY,
+                                       self.PageMTime(page))
+        def prescale(decodedName, image):
+            if key[2:] == (self.VIEWMODE, self.clientSizeX, self.clientSizeY):
+                wx.CallAfter(self.StorePrescaled, key, self.scaleImage(image.Copy()))
+        return prescale
+
+    def StorePrescaled(self, key, image):
+        """ converts a page scaled in the background to a bitmap, unless the view changed meanwhile """
+        if key[2:] == (self.VIEWMODE, self.clientSizeX, self.clientSizeY):
+            self.store.PutBitmap(key, image.ConvertToBitmap())
+
+    def SetPages(self, file1=None, file2=None, page1=None, page2=None):
+        """
+        sets the page bitmaps in the frame from the page files. 
+        rescales according to view mode
+        page1 and page2 are the pages of the files, if known
+        """
+        if file1 != None and not self.pdfON:
+            self.page1 = self.GetPageBitmap(file1, page1)
+            self.page2 = self.GetPageBitmap(file2, page2)
+            # the pages on screen must stay resident whatever the budget
+            self.store.Pin([self.store.MakeBitmapKey(f, self.VIEWMODE, self.clientSizeX, self.clientSizeY, self.PageMTime(p))
+                            for (f, p) in ((file1, page1), (file2, page2))])
 
     def DrawImages(self):
         self.currentPiece = pgm.GetCurrentPiece()
@@ -1328,75 +1660,350 @@ class vptFrame(wx.Frame, TwainBase):
             self.currentPage = self.currentPiece.GetCurrentPage()
             if self.currentPage:
                 pageName = self.currentPage.GetFileName()
-        dc = wx.BufferedPaintDC(self)
-        # viewMode = options.getOption('VIEW_MODE')
+        # the pages are kept composed in the backbuffer; it is only redrawn when the scene changed,
+        # so an expose just blits the damaged rectangles back
+        dc = wx.PaintDC(self)
+        if self.backBufferSignature != self.SceneSignature():
+            self.ComposeBackBuffer()
+        mdc = wx.MemoryDC(self.backBuffer)
+        regions = wx.RegionIterator(self.GetUpdateRegion())
+        while regions:
+            r = regions.GetRect()
+            dc.Blit(r.x, r.y, r.width, r.height, mdc, r.x, r.y)
+            regions.Next()
+        mdc.SelectObject(wx.NullBitmap)
+        # write the current annotation if we are placeing one now
+        if self.annotationText:
+            if self.floatingRect == None:
+                self.floatingRect = self.FloatingTextRect(self.ScreenToClient(wx.GetMousePosition()))
+            # where OnMouseMove last saw the mouse, which is the rectangle it will invalidate next
+            dc.SetFont(self.annotationFont)
+            wx.SetCursor(wx.StockCursor(wx.CURSOR_CROSS))
+            dc.SetTextForeground(wx.RED)
+            dc.DrawText(self.annotationText,self.floatingRect.x,self.floatingRect.y)
+        else:
+            wx.SetCursor(wx.StockCursor(wx.CURSOR_ARROW))
+        return
+
+    def DrawPages(self, dc):
+        """
+        draws the page bitmaps and their annotations on dc; returns True if the
+        Fit Width layout had to be corrected on the way (see DrawStrip)
+        """
+        w = self.page1.GetWidth()
+        if self.ShowingStrip():
+            return self.DrawStrip(dc)
         if self.VIEWMODE == "Fit Width":
             dc.DrawBitmap(self.page1,self.xpos,self.ypos,True)
             h = self.page1.GetHeight()
             dc.DrawBitmap(self.page2,self.xpos,self.ypos+h,True)
         if self.VIEWMODE == "Two Page":
-            dc.DrawBitmap(self.page1,self.xpos, self.ypos, True)
-            w = self.page1.GetWidth()
-            dc.DrawBitmap(self.page2, self.xpos+w, self.ypos, True)
+            self.DrawSpread(dc, self.page1, self.page2, self.currentPiece, self.currentPage, self.nextPage)
+            return
         if self.currentPage:
-            annots = self.currentPage.GetAnnotations()
             # write the annotations for this page
-            if len(annots) > 0:
-                for a in annots:
-                    if a.GetMode() == self.VIEWMODE:
-                        (x,y)=a.GetPosition()
-                        (x,y)=self.Map2Image(x,y)
-                        (x,y)=self.ScreenToClient((x,y))
-                        t = a.GetText()
-                        f = a.GetFont()
-                        dc.SetFont(f)
-                        dc.SetTextForeground(wx.RED)
-                        dc.DrawText(t,x,y)
-        if self.nextPage and self.VIEWMODE == "Two Page":
-            annots = self.nextPage.GetAnnotations()
+            self.DrawAnnotations(dc, self.currentPiece, self.currentPage, self.xpos, self.ypos)
+
+    def DrawSpread(self, dc, bitmap1, bitmap2, piece, page1, page2):
+        """ draws a Two Page spread: the two bitmaps side by side with the annotations of page1 and page2 of piece """
+        w = bitmap1.GetWidth()
+        dc.DrawBitmap(bitmap1, self.xpos, self.ypos, True)
+        dc.DrawBitmap(bitmap2, self.xpos+w, self.ypos, True)
+        if page1:
+            # write the annotations for this page
+            self.DrawAnnotations(dc, piece, page1, self.xpos, self.ypos)
+        if page2:
             # write the annotations for second page
-            if len(annots) > 0:
-                for a in annots:
-                    if a.GetMode() == self.VIEWMODE:
-                        (x,y)=a.GetPosition()
-                        (x,y)=self.Map2Image(x,y)
-                        (x,y)=self.ScreenToClient((x,y))
-                        t = a.GetText()
-                        f = a.GetFont()
-                        dc.SetFont(f)
-                        dc.SetTextForeground(wx.RED)
-                        dc.DrawText(t,x+w,y)
-            # write the current annotation if we are placeing one now
-        if self.annotationText:
-            mp=self.ScreenToClient(wx.GetMousePosition())
-            dc.SetFont(self.annotationFont)
-            wx.SetCursor(wx.StockCursor(wx.CURSOR_CROSS))
-            dc.SetTextForeground(wx.RED)
-            dc.DrawText(self.annotationText,mp.x,mp.y)
-        else:
-            wx.SetCursor(wx.StockCursor(wx.CURSOR_ARROW))
-        return
+            self.DrawAnnotations(dc, piece, page2, self.xpos+w, self.ypos)
 
-    def ConvertImages(self, img1, img2):
-        if not self.pdfON:
-            self.page1 = img1.ConvertToBitmap()
-            self.page2 = img2.ConvertToBitmap()
+    def DrawAnnotations(self, dc, piece, page, pageX, pageY):
+        """ draws the cached annotation overlay of page of piece, whose top left corner is at pageX,pageY """
+        overlay = self.GetAnnotationOverlay(piece, page)
+        if overlay:
+            (bitmap, x, y) = overlay
+            dc.DrawBitmap(bitmap, pageX+x, pageY+y, True)
 
-    def Page1Visible(self):
-        """ returns True if Page 1 is visible, False otherwise """
-        if (self.ypos + self.page1.GetHeight() > 0) and (self.ypos <  self.clientSizeY):
-            return True
-        else:
-            return False
+    def GetAnnotationOverlay(self, piece, page):
+        """
+        Returns (bitmap, x, y): the annotations of page of piece for the current view mode pre-rendered
+        into a transparent bitmap placed at x,y from the page origin, or None if there are none.
+        Overlays are cached in the page image store per page file, view mode and scale, under its
+        memory budget, and rebuilt only when the annotations of that page change.
+        They are keyed on the path of the page file rather than the Page, so the store holds
+        no pieces alive and InvalidateFile drops them with the page's images.
+        """
+        annots = [a for a in page.GetAnnotations() if a.GetMode() == self.VIEWMODE]
+        if not annots:
+            return None
+        # annotations are saved in screen coordinates relative to the page origin
+        (originX, originY) = self.ClientToScreen((0,0))
+        key = (''.join([piece.GetName(), os.sep, page.GetPageFileName()]), page.revision,
+               self.VIEWMODE, self.clientSizeX, self.clientSizeY, originX, originY)
+        overlay = self.store.GetOverlay(key)
+        if overlay == None:
+            mdc = wx.MemoryDC()
+            placed = []
+            bounds = None
+            font = None
+            for a in annots:
+                (x,y) = a.GetPosition()
+                if a.GetFont() is not font:
+                    font = a.GetFont()
+                    mdc.SetFont(font)
+                (tw,th) = mdc.GetTextExtent(a.GetText())
+                rect = wx.Rect(x-originX, y-originY, max(1,tw), max(1,th))
+                placed.append((a, rect))
+                if bounds == None:
+                    bounds = wx.Rect(rect.x, rect.y, rect.width, rect.height)
+                else:
+                    bounds.Union(rect)
+            bitmap = wx.EmptyBitmap(bounds.width, bounds.height)
+            mdc.SelectObject(bitmap)
+            # antialiased edges blend towards white, which matches the paper of the page
+            mdc.SetBackground(wx.WHITE_BRUSH)
+            mdc.Clear()
+            mdc.SetTextForeground(wx.RED)
+            # fonts are shared through fontTable, so grouping by font sets each one once
+            placed.sort(key=lambda (a, rect): id(a.GetFont()))
+            font = None
+            for (a, rect) in placed:
+                if a.GetFont() is not font:
+                    font = a.GetFont()
+                    mdc.SetFont(font)
+                mdc.DrawText(a.GetText(), rect.x-bounds.x, rect.y-bounds.y)
+            mdc.SelectObject(wx.NullBitmap)
+            bitmap.SetMask(wx.Mask(bitmap, wx.WHITE))
+            overlay = (bitmap, bounds.x, bounds.y)
+            self.store.PutOverlay(key, overlay)
+        return overlay
+
+    def DrawStrip(self, dc):
+        """
+        draws every page of the strip that intersects the window, with its annotations.
+        Returns True if the height of a page had to be corrected, which moves the pages below it.
+        """
+        piece = self.currentPiece
+        viewTop = self.ViewTop()
+        corrected = False
+        for i in self.strip.PagesIn(viewTop, self.clientSizeY):
+            page = piece.pages[i]
+            bitmap = self.GetPageBitmap(piece.GetPagePath(page), page)
+            # the layout is estimated from the file headers; trust the real bitmap
+            if self.strip.SetHeight(i, bitmap.GetHeight()):
+                corrected = True
+            top = self.strip.Top(i) - viewTop
+            dc.DrawBitmap(bitmap, self.xpos, top, True)
+            if piece.GetPagePath(page) not in self.loadedAnnotations:
+                self.LoadAnnotations(page, self.ConstructAnnotationFileName(page))
+                self.loadedAnnotations.add(piece.GetPagePath(page))
+            self.DrawAnnotations(dc, piece, page, self.xpos, top)
+        return corrected
+
+    def BuildStrip(self):
+        """ lays out the current piece for Fit Width mode, unless it already is at this width """
+        piece = self.currentPiece
+        key = (piece, [p.GetFileName() for p in piece.pages], self.clientSizeX)
+        if key == self.stripKey:
+            return
+        if self.stripKey == None or self.stripKey[0] != piece:
+            self.loadedAnnotations = set()
+        sizes = []
+        for page in piece.pages:
+            sizes.append(self.GetPageSize(piece, page))
+        self.strip = PageStrip(sizes, self.clientSizeX)
+        self.stripKey = key
+
+    def ForgetStrip(self):
+        self.strip = None
+        self.stripKey = None
+
+    def ShowingStrip(self):
+        """ True if the window shows the Fit Width strip, laid out for the piece and page now current """
+        piece = self.currentPiece
+        return (self.VIEWMODE == "Fit Width" and self.strip != None and piece != None
+                and self.stripKey != None and self.stripKey[0] is piece and piece.GetPageIndex() != None)
+
+    def GetPageSize(self, piece, page):
+        """ full size of a page, from the piece manifest, its pyramid or file header, decoding it only as a last resort """
+        size = page.GetSize()
+        if size == None:
+            size = self.pyramidBuilder.GetPyramid(piece.GetName()).GetSize(page.GetFileName())
+        if size == None:
+            size = ReadImageSize(piece.GetPagePath(page))
+        if size == None or size[0] <= 0:
+            image = self.store.GetImage(piece.GetPagePath(page))
+            size = (max(1,image.GetWidth()), image.GetHeight())
+        return size
+
+    def ViewTop(self):
+        """ offset of the top of the window from the top of the Fit Width strip """
+        return self.strip.Top(self.currentPiece.GetPageIndex()) - self.ypos
+
+    def ScrollStrip(self, amount):
+        """
+        Moves the Fit Width view 'amount' pixels down the strip (up if negative).
+        The current page is the one covering the top of the window, so pages turn
+        as they scroll off the top; nothing is reloaded when going backwards.
+        """
+        piece = self.currentPiece
+        oldTop = self.ViewTop()
+        newTop = max(0, min(oldTop + amount, self.strip.Top(self.strip.NumberOfPages()-1)))
+        idx = self.strip.PageAt(newTop)
+        self.ypos = self.strip.Top(idx) - newTop
+        if piece.pages[idx] != self.currentPage:
+            piece.SetCurrentPage(idx)
+            self.prevPage = piece.GetPreviousPage()
+            self.currentPage = piece.GetCurrentPage()
+            self.nextPage = piece.GetNextPage()
+            self.file1 = piece.GetPagePath(self.currentPage)
+            if self.nextPage:
+                self.file2 = piece.GetPagePath(self.nextPage)
+            else:
+                self.file2 = self.file1
+            self.SetPages(self.file1, self.file2, self.currentPage, self.nextPage or self.currentPage)
+            self.UpdateStatusBar()
+            self.ScheduleDecodes()
+        self.ScrollBackBuffer(oldTop)
+
+    def SceneSignature(self):
+        """ everything the contents of the backbuffer depend on """
+        if self.ShowingStrip():
+            return (self.strip, self.stripKey, self.ViewTop(), self.xpos, self.VIEWMODE,
+                    self.clientSizeX, self.clientSizeY)
+        return self.SpreadSignature(self.page1, self.page2, self.currentPage, self.nextPage)
+
+    def SpreadSignature(self, bitmap1, bitmap2, page1, page2):
+        """ the scene signature of showing bitmap1 and bitmap2 for page1 and page2 """
+        revisions = [page.revision for page in (page1, page2) if page]
+        return (bitmap1, bitmap2, self.xpos, self.ypos, self.VIEWMODE,
+                self.clientSizeX, self.clientSizeY, page1, page2, tuple(revisions))
+
+    def ComposeNextSpread(self):
+        """
+        In Two Page mode, draws the spread the next forward turn will show into self.nextSpread,
+        so the turn only has to swap it in.  Nothing is decoded here: it waits until the
+        prefetch has put both page bitmaps in the store.
+        Called on every idle event, so once the spread is composed it returns before touching
+        the file system or the store.
+        """
+        piece = self.currentPiece
+        if self.VIEWMODE != "Two Page" or self.pdfON or self.annotationText or piece == None:
+            return
+        if self.currentPage == None or self.currentPage is not piece.GetCurrentPage():
+            return
+        idx = piece.GetPageIndex()
+        if idx + 1 >= len(piece.pages):
+            return
+        page1 = piece.pages[idx + 1]
+        page2 = None
+        if idx + 2 < len(piece.pages):
+            page2 = piece.pages[idx + 2]
+        if self.nextSpreadSignature != None and self.NextSpreadKey(piece, page1, page2) == self.nextSpreadKey:
+            return
+        file1 = piece.GetPagePath(page1)
+        file2 = file1
+        if page2 != None:
+            file2 = piece.GetPagePath(page2)
+        # peeking leaves the hit and miss counts to the pages actually shown
+        bitmap1 = self.store.PeekBitmap(self.store.MakeBitmapKey(file1, self.VIEWMODE, self.clientSizeX, self.clientSizeY,
+                                                                 self.PageMTime(page1)))
+        bitmap2 = self.store.PeekBitmap(self.store.MakeBitmapKey(file2, self.VIEWMODE, self.clientSizeX, self.clientSizeY,
+                                                                 self.PageMTime(page2 or page1)))
+        if bitmap1 == None or bitmap2 == None:
+            return
+        for page in (page1, page2):
+            if page != None:
+                path = self.ConstructAnnotationFileName(page)
+                if path:
+                    self.LoadAnnotations(page, path)
+                    self.loadedAnnotations.add(piece.GetPagePath(page))
+        # taken after loading the annotations, which may change their revisions
+        self.nextSpreadKey = self.NextSpreadKey(piece, page1, page2)
+        signature = self.SpreadSignature(bitmap1, bitmap2, page1, page2)
+        if signature == self.nextSpreadSignature:
+            return
+        if self.nextSpread == None or self.nextSpread.GetSize() != (self.clientSizeX, self.clientSizeY):
+            self.nextSpread = wx.EmptyBitmap(max(1,self.clientSizeX), max(1,self.clientSizeY))
+        mdc = wx.MemoryDC(self.nextSpread)
+        mdc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+        mdc.Clear()
+        self.DrawSpread(mdc, bitmap1, bitmap2, piece, page1, page2)
+        mdc.SelectObject(wx.NullBitmap)
+        self.nextSpreadSignature = signature
+
+    def NextSpreadKey(self, piece, page1, page2):
+        """ what the spread composed by ComposeNextSpread was composed for, short of the bitmaps """
+        revisions = [page.revision for page in (page1, page2) if page]
+        return (piece, page1, page2, tuple(revisions), self.VIEWMODE,
+                self.clientSizeX, self.clientSizeY, self.xpos, self.ypos)
+
+    def SwapInNextSpread(self):
+        """
+        Called after a forward turn: if the spread composed in the background is what
+        is now to be shown, it becomes the backbuffer and the old backbuffer is reused
+        for the spread after it.
+        """
+        if self.nextSpread == None or self.nextSpreadSignature != self.SceneSignature():
+            return
+        (self.backBuffer, self.nextSpread) = (self.nextSpread, self.backBuffer)
+        self.backBufferSignature = self.nextSpreadSignature
+        self.nextSpreadSignature = None
 
-    def Page2Visible(self):
-        """ returns True if Page 2 is visible.  False otherwise 
-            only meaningful when VIEWMODE is 'Fit Width' 
+    def ResizeBackBuffer(self):
+        """ makes the backbuffers the size of the client area; returns True if they were replaced """
+        if self.backBuffer != None and self.backBuffer.GetSize() == (self.clientSizeX, self.clientSizeY):
+            return False
+        self.backBuffer = wx.EmptyBitmap(max(1,self.clientSizeX), max(1,self.clientSizeY))
+        self.spareBuffer = wx.EmptyBitmap(max(1,self.clientSizeX), max(1,self.clientSizeY))
+        self.backBufferSignature = None
+        return True
+
+    def InvalidateBackBuffer(self):
+        """ forces the next paint to compose the backbuffer again, e.g. after annotations change """
+        self.backBufferSignature = None
+
+    def ComposeBackBuffer(self, rect=None):
+        """ draws the pages into the backbuffer, only inside rect if it is given """
+        if self.ResizeBackBuffer():
+            rect = None
+        mdc = wx.MemoryDC(self.backBuffer)
+        if rect:
+            mdc.SetClippingRect(rect)
+        mdc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+        mdc.Clear()
+        if self.DrawPages(mdc):
+            # pages moved under what was drawn or kept of the backbuffer, so draw all of it again
+            mdc.DestroyClippingRegion()
+            mdc.Clear()
+            self.DrawPages(mdc)
+            self.Refresh(False)
+        mdc.SelectObject(wx.NullBitmap)
+        self.backBufferSignature = self.SceneSignature()
+
+    def ScrollBackBuffer(self, oldTop):
         """
-        if (self.ypos + self.page1.GetHeight() + self.page2.GetHeight() > 0) and (self.ypos + self.page1.GetHeight() < self.clientSizeY):
-            return True
+        Called after the Fit Width view moved from oldTop down the strip.
+        Shifts the backbuffer by the scroll delta, composes only the newly exposed strip
+        and lets the window scroll its own pixels so just that strip is repainted.
+        """
+        dy = int(round(oldTop - self.ViewTop()))
+        oldSignature = (self.strip, self.stripKey, oldTop, self.xpos, self.VIEWMODE,
+                        self.clientSizeX, self.clientSizeY)
+        if self.annotationText or self.backBufferSignature != oldSignature or abs(dy) >= self.clientSizeY:
+            self.Refresh(eraseBackground=False)
+            return
+        if dy == 0:
+            return
+        mdc = wx.MemoryDC(self.spareBuffer)
+        mdc.DrawBitmap(self.backBuffer, 0, dy)
+        mdc.SelectObject(wx.NullBitmap)
+        (self.backBuffer, self.spareBuffer) = (self.spareBuffer, self.backBuffer)
+        if dy < 0:
+            strip = wx.Rect(0, self.clientSizeY+dy, self.clientSizeX, -dy)
         else:
-            return False
+            strip = wx.Rect(0, 0, self.clientSizeX, dy)
+        self.ComposeBackBuffer(strip)
+        self.ScrollWindow(0, dy, wx.Rect(0, 0, self.clientSizeX, self.clientSizeY))
 
     def UpdateStatusBar(self):
         if pgm == None:
@@ -1433,37 +2040,18 @@ class vptFrame(wx.Frame, TwainBase):
             self.pdf.gotoNextPage()
         else:
             if self.revertPage:
-                pgm.currentPiece.GetCurrentPage().SetFileName(self.revertPageName)
+                pgm.currentPiece.GetCurrentPage().SetScratchFile(None)
                 self.revertPage = None
                 self.revertPageName = None
-            if options.getOption('VIEW_MODE') == "Fit Width":
-                self.ScrollUp()
-                if self.Page1Visible():
-                    self.Refresh(eraseBackground=False)
-                    return
-                else:
-                    self.image1=self.image2
-                    if pgm.currentPiece.TurnForward() == True:
-                        self.ypos = self.ypos + self.page1.GetHeight()
-                        self.prevPage = self.currentPiece.GetPreviousPage()
-                        self.currentPage = self.currentPiece.GetCurrentPage()
-                        self.nextPage = self.currentPiece.GetNextPage()
-                        if self.nextPage:
-                            pageName = self.nextPage.GetFileName()
-                            fileName = ''.join([self.pieceName,'/',pageName])
-                            self.image2 = wx.Image(fileName)
-                        else:
-                            self.image2 = self.image1
-                    else:
-                        self.image2 = self.image1                    
-                    self.SetImages(self.image1, self.image2)
-                    self.Refresh(eraseBackground=False)
-                    self.UpdateStatusBar()
+            if self.VIEWMODE == "Fit Width":
+                if self.strip:
+                    self.ScrollUp()
                 return
             if self.VIEWMODE == "Two Page":
                 if pgm.currentPiece:
                     if pgm.currentPiece.TurnForward() == True:
                         self.LoadCurrentPiece()
+                        self.SwapInNextSpread()
                         self.UpdateStatusBar()
                 return
 
@@ -1473,39 +2061,12 @@ class vptFrame(wx.Frame, TwainBase):
             self.pdf.gotoPreviousPage()
         else:
             if self.revertPage:
-                pgm.currentPiece.GetCurrentPage().SetFileName(self.revertPageName)
+                pgm.currentPiece.GetCurrentPage().SetScratchFile(None)
                 self.revertPage = None
                 self.revertPageName = None
             if self.VIEWMODE == "Fit Width":
-                self.ScrollDown()
-                if self.Page2Visible():
-                    self.Refresh(eraseBackground=False)
-                    return
-                else:
-                    if pgm.currentPiece:
-                        if pgm.currentPiece.TurnBackward() == True:
-                            self.nextPage = self.currentPiece.GetNextPage()
-                            self.currentPage = self.currentPiece.GetCurrentPage()
-                            self.prevPage = self.currentPiece.GetPreviousPage()
-                            if self.currentPage:
-                                pageName = self.currentPage.GetFileName()
-                                fileName = ''.join([self.pieceName,'/',pageName])
-                                self.image1 = wx.Image(fileName)
-                                img1 = self.scaleImage(self.image1)
-                                self.ypos = self.ypos - img1.GetHeight()
-                            if self.nextPage:
-                                pageName = self.nextPage.GetFileName()
-                                fileName = ''.join([self.pieceName,'/',pageName])
-                                self.image2 = wx.Image(fileName)
-                            else:
-                                self.image1 = self.image2
-                        else:
-                            pageName = self.currentPage.GetFileName()
-                            fileName = ''.join([self.pieceName,'/',pageName])
-                            self.image1 = wx.Image(fileName)
-                        self.SetImages(self.image1, self.image2)
-                        self.Refresh(False)
-                        self.UpdateStatusBar()
+                if self.strip:
+                    self.ScrollDown()
                 return
             if options.getOption('VIEW_MODE') == 'Two Page':
                 if pgm.currentPiece:
@@ -1519,16 +2080,21 @@ class vptFrame(wx.Frame, TwainBase):
         self.Refresh(eraseBackground=False)
 
     def ScrollDown(self):
-        self.ypos = self.ypos + self.SCROLL_AMOUNT
-        return self.ypos + self.page1.GetHeight()
+        """ moves the page contents down, i.e. back towards the start of the piece """
+        self.ScrollStrip(-self.SCROLL_AMOUNT)
 
     def ScrollUp(self):
-        self.ypos = self.ypos - self.SCROLL_AMOUNT
-        return self.ypos + self.page1.GetHeight()
+        """ moves the page contents up, i.e. on towards the end of the piece """
+        self.ScrollStrip(self.SCROLL_AMOUNT)
 
 # Annotation
     def LoadAnnotations(self,page,path):
         if os.path.exists(path):
+            source = (path, os.path.getmtime(path))
+            if page.annotationSource == source:
+                # already loaded and unchanged; keeps the cached overlay valid
+                return
+            page.annotationSource = source
             fptr = open(path,'r')
             aFile = fptr.readlines() # get the file
             fptr.close()
@@ -1553,9 +2119,7 @@ class vptFrame(wx.Frame, TwainBase):
                     encoding = int(sFile[idx+7])
                     faceName = sFile[idx+8]
                     faceName = faceName.strip('\n')
-                    font = wx.Font(pointSize=pointSize,family=family,
-                                   style=style,weight=weight,encoding=encoding)
-                    font.SetFaceName(faceName)
+                    font = fontTable.GetFont(pointSize,family,style,weight,encoding,faceName)
                     mode = sFile[idx+9]
                     mode = mode.strip('\n')
                     a = Annotation(x,y,txt,font,mode)
@@ -1568,11 +2132,13 @@ class vptFrame(wx.Frame, TwainBase):
             path = self.ConstructAnnotationFileName(page)
             if path:
                 self.LoadAnnotations(page,path)
+                self.loadedAnnotations.add(self.currentPiece.GetPagePath(page))
         page = self.currentPiece.GetNextPage()
         if page:
             path = self.ConstructAnnotationFileName(page)
             if path:
                 self.LoadAnnotations(page,path)
+                self.loadedAnnotations.add(self.currentPiece.GetPagePath(page))
 
     def SaveAnnotations(self):
         path = self.ConstructAnnotationFileName(self.currentPage)
@@ -1597,6 +2163,8 @@ class vptFrame(wx.Frame, TwainBase):
                              str(style),'\n',str(weight),'\n',str(encoding),'\n',faceName,'\n',mode,'\n']:
                     fptr.writelines(line)
         fptr.close()
+        # what is in memory is what was just written, no need to read it back
+        self.currentPage.annotationSource = (path, os.path.getmtime(path))
 
 
     def drawRectangle(self,pos,size):